@@ -0,0 +1,36 @@
+"""Add user_threads
+
+Revision ID: 3f1c2a7d9e40
+Revises: 9b0df85f099e
+Create Date: 2026-10-18 10:12:31.402113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a7d9e40'
+down_revision: Union[str, None] = '9b0df85f099e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_threads',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('telegram_id', sa.String(), nullable=False),
+        sa.Column('thread_id', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_user_threads_id'), 'user_threads', ['id'], unique=False)
+    op.create_index(op.f('ix_user_threads_telegram_id'), 'user_threads', ['telegram_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_user_threads_telegram_id'), table_name='user_threads')
+    op.drop_index(op.f('ix_user_threads_id'), table_name='user_threads')
+    op.drop_table('user_threads')
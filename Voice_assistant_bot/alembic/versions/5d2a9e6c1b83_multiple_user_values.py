@@ -0,0 +1,54 @@
+"""Allow multiple timestamped values per user
+
+Revision ID: 5d2a9e6c1b83
+Revises: c84e1b5f2a17
+Create Date: 2026-10-18 16:40:12.905317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2a9e6c1b83'
+down_revision: Union[str, None] = 'c84e1b5f2a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The table used to be created by create_tables() rather than a migration
+    if not sa.inspect(op.get_bind()).has_table('user_values'):
+        op.create_table(
+            'user_values',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('telegram_id', sa.String(), nullable=False),
+            sa.Column('value', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('telegram_id', 'value', name='uq_user_values_telegram_id_value')
+        )
+        op.create_index(op.f('ix_user_values_id'), 'user_values', ['id'], unique=False)
+        op.create_index(op.f('ix_user_values_telegram_id'), 'user_values', ['telegram_id'], unique=False)
+        return
+
+    with op.batch_alter_table('user_values') as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+        batch_op.drop_index('ix_user_values_telegram_id')
+        batch_op.create_index('ix_user_values_telegram_id', ['telegram_id'], unique=False)
+        batch_op.create_unique_constraint('uq_user_values_telegram_id_value', ['telegram_id', 'value'])
+
+
+def downgrade() -> None:
+    # Only the most recent value of each user is kept
+    op.execute(
+        'DELETE FROM user_values WHERE id NOT IN '
+        '(SELECT MAX(id) FROM user_values GROUP BY telegram_id)'
+    )
+    with op.batch_alter_table('user_values') as batch_op:
+        batch_op.drop_constraint('uq_user_values_telegram_id_value', type_='unique')
+        batch_op.drop_index('ix_user_values_telegram_id')
+        batch_op.create_index('ix_user_values_telegram_id', ['telegram_id'], unique=True)
+        batch_op.drop_column('created_at')
@@ -0,0 +1,37 @@
+"""Add openai_resources
+
+Revision ID: c84e1b5f2a17
+Revises: 3f1c2a7d9e40
+Create Date: 2026-10-18 14:05:47.218930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c84e1b5f2a17'
+down_revision: Union[str, None] = '3f1c2a7d9e40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'openai_resources',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('resource_id', sa.String(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_openai_resources_id'), 'openai_resources', ['id'], unique=False)
+    op.create_index(op.f('ix_openai_resources_key'), 'openai_resources', ['key'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_openai_resources_key'), table_name='openai_resources')
+    op.drop_index(op.f('ix_openai_resources_id'), table_name='openai_resources')
+    op.drop_table('openai_resources')
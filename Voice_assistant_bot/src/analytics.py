@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+from config import set
+from src.http_client import get_http_session
+
+AMPLITUDE_BATCH_URL = "https://api2.amplitude.com/batch"
+
+
+# Очередь событий аналитики: события копятся в ограниченном буфере и
+# отправляются в Amplitude пачками по размеру или по времени одной фоновой
+# задачей на общем HTTP-пуле. Если Amplitude недоступен, пачка дописывается
+# в локальный JSONL-файл и отправляется повторно после первой удачной отправки.
+class EventQueue:
+    def __init__(
+        self,
+        api_key: str = set.amplitude_api_key,
+        max_size: int = set.analytics_queue_size,
+        batch_size: int = set.analytics_batch_size,
+        flush_interval: float = set.analytics_flush_interval,
+        overflow: str = set.analytics_overflow,
+        spill_path: str = set.analytics_spill_path,
+        url: str = AMPLITUDE_BATCH_URL
+    ):
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # drop - при переполнении новые события отбрасываются, block - отправитель ждёт места
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.url = url
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.counters = {"queued": 0, "flushed": 0, "dropped": 0, "spilled": 0}
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    # Отправка оставшихся событий при остановке; то, что не успело уйти, сохраняется в файл
+    async def stop(self, timeout: float = 10) -> None:
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не все события аналитики отправлены до остановки")
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+        rest = []
+        while not self.queue.empty():
+            rest.append(self.queue.get_nowait())
+            self.queue.task_done()
+        if rest:
+            await self._spill(rest)
+        logging.info(f"Аналитика: {self.counters}")
+
+    async def track(self, user_id, device_id, event_type: str, event_properties: Optional[dict] = None) -> bool:
+        event = {
+            "event_type": event_type,
+            "user_id": str(user_id),
+            "device_id": str(device_id),
+            "time": int(time.time() * 1000),
+            # По insert_id Amplitude отбрасывает повторы при повторной отправке
+            "insert_id": uuid.uuid4().hex,
+        }
+        if event_properties:
+            event["event_properties"] = event_properties
+
+        if self.overflow == "block":
+            await self.queue.put(event)
+        else:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.counters["dropped"] += 1
+                return False
+        self.counters["queued"] += 1
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logging.error(f"Ошибка при отправке событий в Amplitude: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: list) -> None:
+        if await self._send(batch):
+            await self._replay_spill()
+        else:
+            await self._spill(batch)
+
+    # True - пачка принята или отброшена как некорректная, False - повторить позже
+    async def _send(self, events: list) -> bool:
+        try:
+            session = await get_http_session()
+            async with session.post(self.url, json={"api_key": self.api_key, "events": events}) as response:
+                if response.status == 200:
+                    self.counters["flushed"] += len(events)
+                    return True
+                body = await response.text()
+                if response.status == 429 or response.status >= 500:
+                    logging.warning(f"Amplitude временно недоступен ({response.status}): {body}")
+                    return False
+                logging.error(f"Amplitude отклонил пачку событий ({response.status}): {body}")
+                self.counters["dropped"] += len(events)
+                return True
+        except Exception as e:
+            logging.warning(f"Amplitude недоступен: {e}")
+            return False
+
+    async def _spill(self, events: list) -> None:
+        try:
+            await asyncio.to_thread(self._append_spill, events)
+            self.counters["spilled"] += len(events)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении событий аналитики в файл: {e}")
+            self.counters["dropped"] += len(events)
+
+    def _append_spill(self, events: list) -> None:
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def _read_spill(self) -> list:
+        if not os.path.exists(self.spill_path):
+            return []
+        events = []
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Обрезанная строка, например после аварийной остановки
+                    continue
+        os.remove(self.spill_path)
+        return events
+
+    # Повторная отправка событий из файла; неотправленный остаток возвращается в файл
+    async def _replay_spill(self) -> None:
+        events = await asyncio.to_thread(self._read_spill)
+        if not events:
+            return
+        for start in range(0, len(events), self.batch_size):
+            if not await self._send(events[start:start + self.batch_size]):
+                await self._spill(events[start:])
+                return
+        logging.info(f"Из файла отправлено событий аналитики: {len(events)}")
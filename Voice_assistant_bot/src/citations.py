@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from config import set
+
+
+# Имена файлов базы знаний по file_id для подписей цитат. Набор файлов
+# небольшой и меняется редко, поэтому имена кэшируются с TTL, а промахи
+# по нескольким файлам разрешаются параллельно
+class FileNameCache:
+    def __init__(self, client, ttl: float = set.file_cache_ttl):
+        self.client = client
+        self.ttl = ttl
+        self.names: dict[str, tuple[float, str]] = {}
+        # Запросы, которые уже выполняются, чтобы не запрашивать файл дважды
+        self.pending: dict[str, asyncio.Task] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def get(self, file_id: str) -> Optional[str]:
+        entry = self.names.get(file_id)
+        if entry is None:
+            return None
+        expires, filename = entry
+        if expires < time.monotonic():
+            del self.names[file_id]
+            return None
+        return filename
+
+    def put(self, file_id: str, filename: str) -> None:
+        self.names[file_id] = (time.monotonic() + self.ttl, filename)
+
+    async def resolve(self, file_ids) -> dict[str, str]:
+        result = {}
+        missing = []
+        for file_id in dict.fromkeys(file_ids):
+            filename = self.get(file_id)
+            if filename is None:
+                missing.append(file_id)
+            else:
+                result[file_id] = filename
+
+        tasks = {}
+        for file_id in missing:
+            task = self.pending.get(file_id)
+            if task is None:
+                task = asyncio.create_task(self._retrieve(file_id))
+                self.pending[file_id] = task
+                task.add_done_callback(lambda _, file_id=file_id: self.pending.pop(file_id, None))
+            tasks[file_id] = task
+
+        if tasks:
+            names = await asyncio.gather(*tasks.values())
+            for file_id, filename in zip(tasks, names):
+                # Если имя получить не удалось, в подписи остаётся file_id
+                result[file_id] = filename or file_id
+        return result
+
+    async def _retrieve(self, file_id: str) -> Optional[str]:
+        try:
+            cited_file = await self.client.files.retrieve(file_id)
+        except Exception as e:
+            logging.error(f"Ошибка при получении имени файла {file_id}: {e}")
+            return None
+        self.put(file_id, cited_file.filename)
+        return cited_file.filename
+
+    # Фоновый прогрев при запуске: имена из реестра ресурсов и список файлов векторного хранилища
+    def start(self, registry) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._warm_up(registry))
+
+    async def _warm_up(self, registry) -> None:
+        try:
+            await registry.get_assistant_id()
+            for file_id, filename in registry.file_names.items():
+                self.put(file_id, filename)
+            file_ids = [
+                vector_store_file.id
+                async for vector_store_file in self.client.beta.vector_stores.files.list(vector_store_id=registry.vector_store_id)
+            ]
+            await self.resolve(file_ids)
+        except Exception as e:
+            logging.error(f"Ошибка при прогреве кэша имён файлов: {e}")
+
+
+# Замена меток аннотаций на [n] за один проход по тексту; возвращает текст и подписи цитат
+def apply_annotations(value: str, annotations, file_names: dict[str, str]) -> tuple[str, list[str]]:
+    parts = []
+    citations = []
+    position = 0
+    for index, annotation in enumerate(sorted(annotations, key=lambda annotation: annotation.start_index)):
+        if annotation.start_index < position:
+            continue
+        parts.append(value[position:annotation.start_index])
+        parts.append(f"[{index}]")
+        position = annotation.end_index
+        if file_citation := getattr(annotation, "file_citation", None):
+            citations.append(f"[{index}] {file_names.get(file_citation.file_id, file_citation.file_id)}")
+    parts.append(value[position:])
+    return "".join(parts), citations
+
+
+def cited_file_ids(annotations) -> list[str]:
+    return [
+        annotation.file_citation.file_id
+        for annotation in annotations
+        if getattr(annotation, "file_citation", None)
+    ]
@@ -2,12 +2,9 @@ from pydantic_settings import BaseSettings
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 
-from openai import OpenAI
-
-from concurrent.futures import ThreadPoolExecutor
-
 
 class Settings(BaseSettings):
     openai_api_key: str
@@ -15,119 +12,176 @@ class Settings(BaseSettings):
     database_url: str
     amplitude_api_key: str
 
+    # Сколько тредов пользователей держать в памяти
+    thread_cache_size: int = 10000
+
+    # Потоковый ответ с синтезом речи по предложениям
+    stream_responses: bool = True
+    tts_min_sentence_chars: int = 40
+    # Предложения склеиваются в одно голосовое сообщение, пока их не наберётся
+    # столько символов или пока с первого из них не пройдёт столько секунд
+    # (Telegram ограничивает частоту сообщений в чат)
+    tts_stream_group_chars: int = 400
+    tts_stream_group_delay: float = 4
+
+    # Сколько раз повторять отправку в Telegram после ответа RetryAfter
+    telegram_send_retries: int = 3
+
+    # Синтез длинных ответов по кускам: размер куска (лимит tts-1 - 4096) и число параллельных запросов
+    tts_chunk_chars: int = 800
+    tts_workers: int = 4
+
+    # Размер голосового файла, начиная с которого буфер сбрасывается на диск
+    # (меньше лимита Bot API в 20 МБ, иначе сброс никогда не происходит)
+    voice_spool_threshold: int = 8 * 1024 * 1024
+
+    # Общий пул HTTP-соединений
+    http_limit: int = 100
+    http_limit_per_host: int = 30
+    http_keepalive_timeout: float = 60
+    http_timeout: float = 120
+    http_connect_timeout: float = 10
+    http_read_timeout: float = 30
+    http_chunk_size: int = 64 * 1024
+
+    # Кэш синтезированных фраз: каталог, общий размер и максимальная длина кэшируемой фразы
+    tts_cache_dir: str = "tts_cache"
+    tts_cache_max_bytes: int = 200 * 1024 * 1024
+    tts_cache_max_chars: int = 200
+    # Фраза кэшируется, только если встретилась столько раз (фиксированные ответы
+    # и ошибки), а ответы ассистента пользователям на диск не попадают
+    tts_cache_min_repeats: int = 3
+    tts_cache_counter_size: int = 10000
+    # Как часто индекс file_id сохраняется на диск, секунд
+    tts_cache_index_flush_interval: float = 30
+
+    # Файлы базы знаний ассистента
+    knowledge_files: list[str] = ["C:\\Users\\thatn\\Desktop\\At_Latoken.docx", "C:\\Users\\thatn\\Desktop\\Anxiety.docx"]
+
+    # Время жизни кэша имён файлов для подписей цитат, секунды
+    file_cache_ttl: float = 24 * 3600
+
+    # Очередь событий аналитики: размер буфера, размер пачки, период отправки,
+    # поведение при переполнении (drop - отбрасывать, block - ждать) и файл для недоставленных событий
+    analytics_queue_size: int = 10000
+    analytics_batch_size: int = 100
+    analytics_flush_interval: float = 5
+    analytics_overflow: str = "drop"
+    analytics_spill_path: str = "analytics_spill.jsonl"
+
+    # Движок БД: логирование запросов и пул соединений (для SQLite пул не настраивается)
+    database_echo: bool = False
+    database_pool_size: int = 10
+    database_max_overflow: int = 20
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = 1800
+
+    # Отложенная запись ценностей: размер пачки и период сброса, секунды
+    db_write_batch_size: int = 500
+    db_flush_interval: float = 2
+
+    # Кэш ценностей пользователей для персонализации: размер, TTL, число ценностей
+    # на пользователя и число последних записей для прогрева при запуске
+    user_value_cache_size: int = 50000
+    user_value_cache_ttl: float = 3600
+    user_values_per_user: int = 10
+    user_value_warm_rows: int = 20000
+
+    # Лимиты OpenAI по моделям: [запросов в минуту, токенов в минуту], 0 - без ограничения.
+    # Регулятор держит нагрузку на долю headroom от квоты и повторяет вызов после 429
+    rate_limits: dict[str, list[int]] = {"gpt-4o": [500, 30000], "whisper-1": [50, 0], "tts-1": [50, 0]}
+    rate_limit_headroom: float = 0.9
+    rate_limit_burst_seconds: float = 5
+    rate_limit_retries: int = 3
+
+    # Дублирование медленных запросов и повторы: квантиль задержки, после которого
+    # отправляется дубль, размер окна статистики и минимум замеров, число попыток,
+    # границы задержки между попытками и общий срок запроса, секунды
+    hedge_quantile: float = 0.95
+    hedge_window: int = 200
+    hedge_min_samples: int = 20
+    retry_attempts: int = 3
+    retry_base_delay: float = 0.25
+    retry_max_delay: float = 4
+    request_deadline: float = 60
+    # Срок синтеза речи короче: кусок текста озвучивается за секунды, и ответ
+    # ждёт пользователь
+    speech_deadline: float = 30
+
+    # Анализ фото: режим (url, size, downscale), минимальная большая сторона
+    # изображения, детализация для gpt-4o, качество JPEG при уменьшении и кэш результатов
+    photo_mode: str = "size"
+    photo_min_side: int = 512
+    photo_detail: str = "low"
+    photo_jpeg_quality: int = 85
+    photo_cache_size: int = 10000
+    photo_cache_ttl: float = 7 * 24 * 3600
+
+    # Распознавание речи: кэш по file_unique_id, длительность, начиная с которой
+    # сообщение делится на части, целевая длина части, окно поиска паузы вокруг
+    # точки разреза (секунды) и число частей, распознаваемых одновременно
+    transcript_cache_size: int = 10000
+    transcript_cache_ttl: float = 7 * 24 * 3600
+    transcribe_segment_min_seconds: int = 90
+    transcribe_segment_seconds: float = 45
+    transcribe_search_seconds: float = 10
+    transcribe_workers: int = 4
+
+    # Режим получения обновлений: polling или webhook. Для webhook - публичный адрес
+    # (если пуст, setWebhook не вызывается, например когда его выставляет другой экземпляр),
+    # путь, адрес и порт локального сервера, секрет, размер очереди обновлений, число
+    # обработчиков, время дообработки при остановке и лимит соединений со стороны Telegram
+    run_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: str = ""
+    webhook_queue_size: int = 1000
+    webhook_workers: int = 16
+    webhook_drain_timeout: float = 30
+    webhook_max_connections: int = 40
+
     class Config:
         env_file = 'D:\Programming\Python\GPT\Voice_AI_bot_on_Aiogram\Voice_assistant_bot_2\.env'
 
 set = Settings()
 
-bot_tg = Bot(token=set.telegram_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-
-client = OpenAI(api_key=set.openai_api_key)
-
-executor = ThreadPoolExecutor(max_workers=5)
-
-assistant = client.beta.assistants.create(
-    name="Professional interlocutor",
-    instructions="You are a professional interlocutor. You need to answer questions, ask your own and maintain dialogue as much as possible.",
-    model="gpt-4o",
-    tools=[
-        {"type": "file_search"},
-        {
-            "type": "function",
-            "function": {
-                "name": "save_value",
-                "description": "Define and gather user opinions and key values",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "opinions": {
-                            "type": "string",
-                            "description": "Opinions"
-                        },
-                        "values": {
-                            "type": "array",
-                            "items": {
-                                "type": "string"
-                            },
-                            "description": "Values important"
-                        }
+# Запросы к Bot API идут через собственный пул aiogram с теми же ограничениями
+bot_tg = Bot(token=set.telegram_bot_token, session=AiohttpSession(limit=set.http_limit_per_host), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+# Описание ассистента. Сами ассистент, векторное хранилище и файлы базы
+# знаний создаются не при импорте, а через реестр ресурсов (src/registry.py),
+# который переиспользует их, пока описание и файлы не изменились
+ASSISTANT_NAME = "Professional interlocutor"
+ASSISTANT_INSTRUCTIONS = "You are a professional interlocutor. You need to answer questions, ask your own and maintain dialogue as much as possible."
+ASSISTANT_MODEL = "gpt-4o"
+ASSISTANT_TOOLS = [
+    {"type": "file_search"},
+    {
+        "type": "function",
+        "function": {
+            "name": "save_value",
+            "description": "Define and gather user opinions and key values",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "opinions": {
+                        "type": "string",
+                        "description": "Opinions"
                     },
-                    "required": ["opinions", "values"]
-                }
+                    "values": {
+                        "type": "array",
+                        "items": {
+                            "type": "string"
+                        },
+                        "description": "Values important"
+                    }
+                },
+                "required": ["opinions", "values"]
             }
         }
-    ]
-)
-           
-thread = client.beta.threads.create()
-
-# Create a vector store caled "Financial Statements"
-vector_store = client.beta.vector_stores.create(name="Financial Statements")
-    
-# Ready the files for upload to OpenAI
-file_paths = ["C:\\Users\\thatn\\Desktop\\At_Latoken.docx", "C:\\Users\\thatn\\Desktop\\Anxiety.docx"]
-file_streams = [open(path, "rb") for path in file_paths]
-    
-# Use the upload and poll SDK helper to upload the files, add them to the vector store,
-# and poll the status of the file batch for completion.
-file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-    vector_store_id=vector_store.id, files=file_streams
-)
-    
-# You can print the status and the file counts of the batch to see the result of this operation.
-# print(file_batch.status)
-# print(file_batch.file_counts)
-
-assistant = client.beta.assistants.update(
-    assistant_id=assistant.id,
-    tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
-)
-
-# Upload the user provided file to OpenAI
-message_file_0 = client.files.create(
-    file = open("C:\\Users\\thatn\\Desktop\\At_Latoken.docx", "rb"), purpose="assistants"
-)
-
-message_file_1 = client.files.create(
-    file = open("C:\\Users\\thatn\\Desktop\\Anxiety.docx", "rb"), purpose="assistants"
-)
-    
-# Create a thread and attach the file to the message
-thread =  client.beta.threads.create(
-    messages=[
-        {
-        "role": "user",
-        "content": "Что такое тревожность?",
-        # Attach the new file to the message.
-        "attachments": [
-            { "file_id": message_file_0.id, "tools": [{"type": "file_search"}] },
-            { "file_id": message_file_1.id, "tools": [{"type": "file_search"}] }
-        ],
-        }
-    ]
-)
-    
-# The thread now has a vector store with that file in its tool resources.
-# print(thread.tool_resources.file_search)
-
-# Use the create and poll SDK helper to create a run and poll the status of
-# the run until it's in a terminal state.
-
-run = client.beta.threads.runs.create_and_poll(
-    thread_id=thread.id, assistant_id=assistant.id
-)
-
-messages = list(client.beta.threads.messages.list(thread_id=thread.id, run_id=run.id))
-
-message_content = messages[0].content[0].text
-annotations = message_content.annotations
-citations = []
-for index, annotation in enumerate(annotations):
-    message_content.value = message_content.value.replace(annotation.text, f"[{index}]")
-    if file_citation := getattr(annotation, "file_citation", None):
-        cited_file = client.files.retrieve(file_citation.file_id)
-        citations.append(f"[{index}] {cited_file.filename}")
-
-
-
+    }
+]
 
+VECTOR_STORE_NAME = "Financial Statements"
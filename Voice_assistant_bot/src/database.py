@@ -6,8 +6,18 @@ from config import set
 DATABASE_URL = set.database_url
 print("DATABASE_URL = ", DATABASE_URL)
 
-# Создаем асинхронный движок и сессию
-engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=True)
+# Создаем асинхронный движок и сессию; у SQLite свой пул, настройки пула
+# передаются только серверным БД
+engine_options = {"echo": set.database_echo}
+if not DATABASE_URL.startswith("sqlite"):
+    engine_options.update(
+        pool_size=set.database_pool_size,
+        max_overflow=set.database_max_overflow,
+        pool_timeout=set.database_pool_timeout,
+        pool_recycle=set.database_pool_recycle,
+        pool_pre_ping=True
+    )
+engine: AsyncEngine = create_async_engine(DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
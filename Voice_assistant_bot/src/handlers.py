@@ -6,8 +6,8 @@ from aiogram.types import Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from src.utils import convert_voice_to_text, get_ai_response, convert_text_to_voice, send_voice_message, analyze_photo, send_event_to_amplitude, save_user_value
-from config import bot_tg, set, executor
+from src.utils import convert_voice_to_text, get_ai_response, send_voice_reply, stream_voice_reply, analyze_photo, analytics, save_user_value
+from config import set
 
 dp = Dispatcher()
 
@@ -31,15 +31,15 @@ async def handle_voice_message(message: Message, state: FSMContext):
             "keywords": ["voise", "message"],
             "likes": True
         }
-        executor.submit(send_event_to_amplitude, user_id, chat_id, event_type, event)
+        await analytics.track(user_id, chat_id, event_type, event)
         
-        file_id = message.voice.file_id
-        text = await convert_voice_to_text(file_id)
+        voice = message.voice
+        text = await convert_voice_to_text(voice.file_id, user_id, voice.file_unique_id, voice.duration)
+        if set.stream_responses:
+            await stream_voice_reply(message.chat.id, text, user_id)
+            return
         assistants_response = await get_ai_response(text, user_id)
-        voice_path = await convert_text_to_voice(assistants_response)
-        if voice_path:
-            await send_voice_message(message.chat.id, voice_path)
-        else:
+        if not await send_voice_reply(message.chat.id, assistants_response):
             await message.answer("Ошибка при конвертации текста в голос.")
     except Exception as e:
         logging.error(f"Ошибка в обработчике голосовых сообщений: {e}")
@@ -57,15 +57,15 @@ async def handle_text_message(message: Message, state: FSMContext) -> None:
             "keywords": ["text", "message"],
             "likes": True
         }
-        executor.submit(send_event_to_amplitude, user_id, chat_id, event_type, event)
+        await analytics.track(user_id, chat_id, event_type, event)
         
         text = message.text
+        if set.stream_responses:
+            await stream_voice_reply(message.chat.id, text, user_id)
+            return
         assistants_response = await get_ai_response(text, user_id)
         # await message.answer(assistants_response)
-        voice_path = await convert_text_to_voice(assistants_response)
-        if voice_path:
-            await send_voice_message(message.chat.id, voice_path)
-        else:
+        if not await send_voice_reply(message.chat.id, assistants_response):
             await message.answer("Ошибка при конвертации текста в голос.")
     except Exception as e:
         logging.error(f"Ошибка в обработчике голосовых сообщений: {e}")
@@ -83,28 +83,18 @@ async def handle_image_message(message: Message, state: FSMContext) -> None:
             "keywords": ["emotion", "photo", "image", "analyses"],
             "likes": True
         }
-        executor.submit(send_event_to_amplitude, user_id, chat_id, event_type, event)
-        
-        # Анализ фото
-        file_id = message.photo[-1].file_id
-        file_info = await bot_tg.get_file(file_id)
-        file_path = file_info.file_path
+        await analytics.track(user_id, chat_id, event_type, event)
         
-        photo_analysis_result = await analyze_photo(file_path)
+        # Анализ фото (размер выбирается по photo_mode)
+        photo_analysis_result = await analyze_photo(message.photo, user_id)
         
         if photo_analysis_result == 'False':
             text = 'На фото нельзя определить человеские эмоции.'
-            voice_path = await convert_text_to_voice(text)
-            if voice_path:
-                await send_voice_message(message.chat.id, voice_path)
-            else:
+            if not await send_voice_reply(message.chat.id, text):
                 await message.answer("Ошибка при конвертации текста в голос.")
         else:
             text = photo_analysis_result
-            voice_path = await convert_text_to_voice(text)
-            if voice_path:
-                await send_voice_message(message.chat.id, voice_path)
-            else:
+            if not await send_voice_reply(message.chat.id, text):
                 await message.answer("Ошибка при конвертации текста в голос.")
         
     except Exception as e:
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import aiohttp
+import openai
+
+from config import set
+
+
+# Сбои, после которых запрос имеет смысл повторить: обрыв соединения,
+# таймаут и ответы 5xx. 429 повторяет регулятор запросов.
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 408
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 408
+    return False
+
+
+# Скользящее окно длительностей успешных вызовов
+class LatencyTracker:
+    def __init__(self, window: int = set.hedge_window):
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+# Обёртка идемпотентных вызовов одного внешнего метода. Вызов, который
+# идёт дольше p95 этого метода, дублируется, и берётся первый успешный
+# ответ. Повторяемые сбои повторяются с экспоненциальной задержкой со
+# случайным разбросом, пока не выйдет общий срок запроса.
+class Endpoint:
+    def __init__(
+        self,
+        name: str,
+        deadline: float = set.request_deadline,
+        quantile: float = set.hedge_quantile,
+        min_samples: int = set.hedge_min_samples,
+        attempts: int = set.retry_attempts,
+        base_delay: float = set.retry_base_delay,
+        max_delay: float = set.retry_max_delay
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency = LatencyTracker()
+        self.hedges = 0
+
+    # Порог дублирования; None, пока статистики недостаточно
+    def hedge_delay(self) -> Optional[float]:
+        if len(self.latency.samples) < self.min_samples:
+            return None
+        return self.latency.percentile(self.quantile)
+
+    # hedge=False - только повторы, для вызовов, которые дороги или пишут в общий буфер
+    async def call(self, request, hedge: bool = True, deadline: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = expires - loop.time()
+            try:
+                if hedge:
+                    return await asyncio.wait_for(self._hedged(request), remaining)
+                return await asyncio.wait_for(self._timed(request), remaining)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.attempts or not is_retryable(e):
+                    raise
+                # Полный разброс: задержка случайна от нуля до экспоненциального потолка
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if loop.time() + delay >= expires:
+                    raise
+                logging.warning(f"{self.name}: повтор {attempt} через {delay:.2f} с после ошибки: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _timed(self, request):
+        started = time.monotonic()
+        result = await request()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, request):
+        first = asyncio.create_task(self._timed(request))
+        delay = self.hedge_delay()
+        if delay is None:
+            return await first
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.hedges += 1
+                pending.add(asyncio.create_task(self._timed(request)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
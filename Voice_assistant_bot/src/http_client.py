@@ -0,0 +1,42 @@
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from config import set
+
+# Общая HTTP-сессия приложения: один пул keep-alive соединений для
+# скачивания файлов Telegram, фото и остальных исходящих запросов бота
+session: Optional[ClientSession] = None
+
+# Создание сессии (вызывается при старте бота)
+async def start_http_session() -> ClientSession:
+    global session
+    if session is None or session.closed:
+        connector = TCPConnector(
+            limit=set.http_limit,
+            limit_per_host=set.http_limit_per_host,
+            keepalive_timeout=set.http_keepalive_timeout,
+            ttl_dns_cache=300
+        )
+        session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(
+                total=set.http_timeout,
+                connect=set.http_connect_timeout,
+                sock_read=set.http_read_timeout
+            )
+        )
+    return session
+
+# Закрытие сессии (вызывается при остановке бота)
+async def close_http_session() -> None:
+    global session
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
+
+# Общая сессия; если хук старта не вызывался, создаётся при первом запросе
+async def get_http_session() -> ClientSession:
+    if session is None or session.closed:
+        return await start_http_session()
+    return session
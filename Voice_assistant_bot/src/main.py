@@ -1,15 +1,47 @@
 import asyncio
 import logging
 import sys
-from config import bot_tg
+from config import bot_tg, set
 from src.handlers import register_handlers1, dp
+from src.http_client import start_http_session, close_http_session
+from src.utils import registry, file_names, analytics, value_writer, value_cache, voice_cache
+from src.database import engine
+from src.webhook import WebhookServer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', stream=sys.stdout)
 
+async def on_startup() -> None:
+    await start_http_session()
+    # Ресурсы ассистента проверяются в фоне, приём обновлений стартует сразу
+    registry.start()
+    file_names.start(registry)
+    analytics.start()
+    value_writer.start()
+    value_cache.start()
+    voice_cache.start()
+
+async def on_shutdown() -> None:
+    # Аналитика отправляет остаток через общую сессию, поэтому останавливается первой
+    await analytics.stop()
+    await close_http_session()
+    await value_writer.stop()
+    await voice_cache.stop()
+    await engine.dispose()
+
+async def run_polling() -> None:
+    # getUpdates не работает, пока у бота установлен webhook
+    await bot_tg.delete_webhook()
+    await dp.start_polling(bot_tg)
+
 def main() -> None:
     try:
         register_handlers1(dp)
-        asyncio.run(dp.start_polling(bot_tg))
+        dp.startup.register(on_startup)
+        dp.shutdown.register(on_shutdown)
+        if set.run_mode == "webhook":
+            asyncio.run(WebhookServer(dp, bot_tg).run())
+        else:
+            asyncio.run(run_polling())
     except Exception as e:
         logging.error(f"Ошибка в основной функции: {e}")
 
@@ -1,11 +1,30 @@
+from datetime import datetime
+
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, String, Text
+from sqlalchemy import DateTime, Integer, String, Text, UniqueConstraint, func
 
 from src.database import Base
 
 class UserValue(Base):
     __tablename__ = "user_values"
+    __table_args__ = (UniqueConstraint("telegram_id", "value", name="uq_user_values_telegram_id_value"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    telegram_id: Mapped[str] = mapped_column(String, unique=True, index=True)
+    telegram_id: Mapped[str] = mapped_column(String, index=True)
     value: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+class UserThread(Base):
+    __tablename__ = "user_threads"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    telegram_id: Mapped[str] = mapped_column(String, unique=True, index=True)
+    thread_id: Mapped[str] = mapped_column(String, nullable=False)
+
+class OpenAIResource(Base):
+    __tablename__ = "openai_resources"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    key: Mapped[str] = mapped_column(String, unique=True, index=True)
+    resource_id: Mapped[str] = mapped_column(String, nullable=False)
+    content_hash: Mapped[str] = mapped_column(String, nullable=False)
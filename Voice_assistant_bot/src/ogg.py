@@ -0,0 +1,248 @@
+import struct
+from typing import NamedTuple
+
+# Работа с потоками Ogg/Opus на уровне страниц (RFC 3533, RFC 7845):
+# чтение, запись с пересчётом CRC и склейка нескольких потоков в один
+
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+CONTINUED = 0x01
+BEGIN_OF_STREAM = 0x02
+END_OF_STREAM = 0x04
+
+
+def _crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+CRC_TABLE = _crc_table()
+
+
+# CRC-32 Ogg (полином 0x04C11DB7 без отражения битов)
+def ogg_crc(data: bytes) -> int:
+    crc = 0
+    table = CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+class OggPage(NamedTuple):
+    header_type: int
+    granule: int
+    serial: int
+    sequence: int
+    segments: bytes
+    data: bytes
+
+    # Число пакетов, которые заканчиваются на этой странице
+    @property
+    def completed_packets(self) -> int:
+        return sum(1 for size in self.segments if size < 255)
+
+    def to_bytes(self) -> bytes:
+        header = PAGE_HEADER.pack(b'OggS', 0, self.header_type, self.granule, self.serial, self.sequence, 0, len(self.segments))
+        page = bytearray(header + self.segments + self.data)
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        return bytes(page)
+
+
+def read_pages(data: bytes) -> list[OggPage]:
+    pages = []
+    offset = 0
+    view = memoryview(data)
+    while offset + PAGE_HEADER.size <= len(data):
+        capture, _, header_type, granule, serial, sequence, _, count = PAGE_HEADER.unpack_from(data, offset)
+        if capture != b'OggS':
+            raise ValueError(f"Invalid Ogg page at offset {offset}")
+        offset += PAGE_HEADER.size
+        segments = bytes(view[offset:offset + count])
+        offset += count
+        size = sum(segments)
+        pages.append(OggPage(header_type, granule, serial, sequence, segments, bytes(view[offset:offset + size])))
+        offset += size
+    return pages
+
+
+# Число страниц заголовков Opus (OpusHead и OpusTags) в начале потока
+def header_page_count(pages: list[OggPage]) -> int:
+    packets = 0
+    for index, page in enumerate(pages):
+        packets += page.completed_packets
+        if packets >= 2:
+            return index + 1
+    return len(pages)
+
+
+# Длительность пакета Opus в отсчётах 48 кГц по его TOC-байту (RFC 6716, 3.1)
+def opus_packet_samples(packet: bytes) -> int:
+    if not packet:
+        return 0
+    config = packet[0] >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        frame = (480, 960)[config % 2]
+    else:
+        frame = (120, 240, 480, 960)[config % 4]
+    code = packet[0] & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * frames
+
+
+# Число отсчётов в пакетах, которые заканчиваются на каждой из страниц
+def page_samples(pages: list[OggPage]) -> list[int]:
+    samples = []
+    packet = bytearray()
+    for page in pages:
+        total = 0
+        offset = 0
+        for size in page.segments:
+            packet += page.data[offset:offset + size]
+            offset += size
+            if size < 255:
+                total += opus_packet_samples(packet)
+                packet = bytearray()
+        samples.append(total)
+    return samples
+
+
+# Склейка нескольких потоков Ogg/Opus с одинаковыми параметрами в один:
+# заголовки берутся из первого потока, у остальных отбрасываются, а
+# серийный номер, номера страниц и granule position пересчитываются.
+# Обрезка конца (granule меньше длины пакетов) допустима только на
+# последней странице, поэтому у всех потоков, кроме последнего, granule
+# считается по фактической длительности пакетов.
+# Pre-skip действует только в начале потока, поэтому вступительные
+# отсчёты кодера у второго и следующих потоков (около 6,5 мс) остаются
+# на стыке. Убрать их можно только вместе с целым первым пакетом (20 мс
+# звука); куски режутся по границам предложений, где и так пауза,
+# поэтому они не обрезаются.
+def concat_opus(streams: list[bytes]) -> bytes:
+    output = bytearray()
+    serial = None
+    sequence = 0
+    granule_offset = 0
+    for index, stream in enumerate(streams):
+        pages = read_pages(stream)
+        headers = header_page_count(pages)
+        if serial is None:
+            serial = pages[0].serial
+            for page in pages[:headers]:
+                output += page._replace(sequence=sequence, header_type=page.header_type & ~END_OF_STREAM).to_bytes()
+                sequence += 1
+
+        last_stream = index == len(streams) - 1
+        audio = pages[headers:]
+        samples = page_samples(audio)
+        stream_samples = 0
+        for position, page in enumerate(audio):
+            header_type = page.header_type & ~(BEGIN_OF_STREAM | END_OF_STREAM)
+            if last_stream and position == len(audio) - 1:
+                header_type |= END_OF_STREAM
+            stream_samples += samples[position]
+            granule = page.granule
+            if granule != -1:
+                granule = granule_offset + (page.granule if last_stream else stream_samples)
+            output += page._replace(header_type=header_type, granule=granule, serial=serial, sequence=sequence).to_bytes()
+            sequence += 1
+        granule_offset += stream_samples
+    return bytes(output)
+
+
+# Размеры пакетов, которые заканчиваются на каждой из страниц
+def page_packet_sizes(pages: list[OggPage]) -> list[list[int]]:
+    sizes = []
+    packet = 0
+    for page in pages:
+        page_sizes = []
+        for size in page.segments:
+            packet += size
+            if size < 255:
+                page_sizes.append(packet)
+                packet = 0
+        sizes.append(page_sizes)
+    return sizes
+
+
+# Громкость у границы после страницы index: средний размер нескольких
+# пакетов по обе стороны от неё (у тишины пакеты Opus заметно меньше)
+def _boundary_loudness(sizes: list[list[int]], index: int, packets: int = 5) -> float:
+    around = sizes[index][-packets:] + sizes[index + 1][:packets]
+    return sum(around) / max(1, len(around))
+
+
+# Отдельный поток из заголовков и части страниц исходного потока:
+# номера страниц и granule position пересчитываются от начала части
+def _segment_stream(headers: list[OggPage], audio: list[OggPage], samples_before: int) -> bytes:
+    output = bytearray()
+    sequence = 0
+    for page in headers:
+        output += page._replace(sequence=sequence, header_type=page.header_type & ~END_OF_STREAM).to_bytes()
+        sequence += 1
+    for position, page in enumerate(audio):
+        header_type = page.header_type & ~(BEGIN_OF_STREAM | END_OF_STREAM)
+        if position == len(audio) - 1:
+            header_type |= END_OF_STREAM
+        granule = page.granule if page.granule == -1 else page.granule - samples_before
+        output += page._replace(header_type=header_type, granule=granule, sequence=sequence).to_bytes()
+        sequence += 1
+    return bytes(output)
+
+
+# Деление потока Ogg/Opus на части примерно по segment_seconds. Разрез
+# делается по границе страниц, на которой не продолжается пакет, и из
+# границ в пределах search_seconds от целевой точки выбирается та, что
+# приходится на самое тихое место, чтобы не резать слово.
+def split_opus(data: bytes, segment_seconds: float, search_seconds: float) -> list[bytes]:
+    pages = read_pages(data)
+    headers = header_page_count(pages)
+    header_pages, audio = pages[:headers], pages[headers:]
+    samples = page_samples(audio)
+    sizes = page_packet_sizes(audio)
+
+    # Конец каждой страницы в отсчётах от начала звука
+    ends = []
+    total = 0
+    for count in samples:
+        total += count
+        ends.append(total)
+
+    segment = int(segment_seconds * 48000)
+    search = int(search_seconds * 48000)
+    cuts = []
+    target = segment
+    while target + segment // 2 < total:
+        best, best_loudness = None, float('inf')
+        for index in range(len(audio) - 1):
+            if abs(ends[index] - target) > search or audio[index + 1].header_type & CONTINUED:
+                continue
+            if cuts and index <= cuts[-1]:
+                continue
+            loudness = _boundary_loudness(sizes, index)
+            if loudness < best_loudness:
+                best, best_loudness = index, loudness
+        if best is None:
+            break
+        cuts.append(best)
+        target = ends[best] + segment
+
+    streams = []
+    start = 0
+    for cut in cuts + [len(audio) - 1]:
+        # granule включает pre-skip из OpusHead, а он действует в каждой
+        # части заново, поэтому вычитается только длительность звука до разреза
+        samples_before = ends[start - 1] if start else 0
+        streams.append(_segment_stream(header_pages, audio[start:cut + 1], samples_before))
+        start = cut + 1
+    return streams
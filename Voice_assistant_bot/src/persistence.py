@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from config import set
+from src.models import UserValue
+from src.database import SessionLocal, engine
+
+DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+# INSERT ... ON CONFLICT DO UPDATE для пачки строк в диалекте текущей БД
+def upsert_user_values(rows: list[dict]):
+    insert = DIALECT_INSERTS.get(engine.dialect.name)
+    if insert is None:
+        raise NotImplementedError(f"Upsert is not supported for dialect '{engine.dialect.name}'")
+    statement = insert(UserValue).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[UserValue.telegram_id, UserValue.value],
+        set_={"created_at": statement.excluded.created_at}
+    )
+
+
+# Отложенная запись ценностей пользователей: записи копятся в памяти
+# (повтор той же ценности только обновляет время) и сбрасываются в БД
+# одним upsert по таймеру или при накоплении batch_size записей
+class UserValueWriter:
+    def __init__(self, batch_size: int = set.db_write_batch_size, flush_interval: float = set.db_flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: dict[tuple[str, str], datetime] = {}
+        # Вызываются после успешной записи со списком telegram_id
+        self.listeners: list[Callable[[list[str]], None]] = []
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+    def save(self, telegram_id, value: str) -> None:
+        self.pending[(str(telegram_id), value)] = datetime.now(timezone.utc)
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    # Остановка с записью всего, что накопилось. Цикл не отменяется, а
+    # завершается сам, чтобы не прервать идущую запись посреди пачки.
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+        if self.pending:
+            logging.error(f"Не записаны ценности пользователей при остановке: {len(self.pending)}")
+
+    async def _run(self) -> None:
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            rows = [
+                {"telegram_id": telegram_id, "value": value, "created_at": created_at}
+                for (telegram_id, value), created_at in batch.items()
+            ]
+            try:
+                async with SessionLocal() as session:
+                    async with session.begin():
+                        await session.execute(upsert_user_values(rows))
+            except Exception as e:
+                logging.error(f"Ошибка при записи ценностей пользователей ({len(rows)}): {e}")
+                self._requeue(batch)
+                return
+            except BaseException:
+                # Отмена посреди записи: пачка не должна потеряться
+                self._requeue(batch)
+                raise
+
+            telegram_ids = list(dict.fromkeys(telegram_id for telegram_id, _ in batch))
+            for listener in self.listeners:
+                listener(telegram_ids)
+
+    # Пачка возвращается в очередь, более новые значения не перезаписываются
+    def _requeue(self, batch: dict[tuple[str, str], datetime]) -> None:
+        for key, created_at in batch.items():
+            self.pending.setdefault(key, created_at)
@@ -0,0 +1,38 @@
+import base64
+import io
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from config import set
+
+
+# Самый маленький из размеров фото, у которого большая сторона не меньше
+# min_side; если такого нет - самый большой. Telegram присылает размеры
+# по возрастанию.
+def pick_photo_size(photo_sizes, min_side: int = set.photo_min_side):
+    for photo in photo_sizes:
+        if max(photo.width, photo.height) >= min_side:
+            return photo
+    return photo_sizes[-1]
+
+
+# Уменьшение изображения до max_side по большей стороне с пересжатием в JPEG.
+# Без Pillow изображение возвращается как есть.
+def downscale_image(data: bytes, max_side: int = set.photo_min_side, quality: int = set.photo_jpeg_quality) -> bytes:
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return data
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality)
+        return output.getvalue()
+
+
+def image_data_url(data: bytes, mime_type: str = "image/jpeg") -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
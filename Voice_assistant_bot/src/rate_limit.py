@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from openai import RateLimitError
+
+from config import set
+
+# Приоритеты: ответы пользователю идут раньше фоновых проверок
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+# Грубая оценка числа токенов текста для лимита TPM
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# Пауза из заголовков Retry-After / retry-after-ms ответа 429, секунды
+def retry_after_seconds(error: Exception, default: float = 1.0) -> float:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return default
+
+
+# Ведро токенов: пополняется равномерно со скоростью per_minute в минуту,
+# вмещает не больше burst_seconds секунд пополнения. Запрос больше ёмкости
+# ждёт полного ведра и списывается целиком (ведро уходит в минус), чтобы
+# крупные запросы не превышали квоту
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_seconds: float = set.rate_limit_burst_seconds):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд будет доступно amount токенов
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+
+
+# Лимиты одной модели: ведра RPM и TPM, пауза после 429 и очереди ожидающих
+# по приоритетам, внутри приоритета - по пользователям по кругу
+class _ModelLimiter:
+    def __init__(self, rpm: float, tpm: float, headroom: float):
+        self.requests = TokenBucket(rpm * headroom) if rpm else None
+        self.tokens = TokenBucket(tpm * headroom) if tpm else None
+        self.paused_until = 0.0
+        self.queues: list[OrderedDict[str, deque]] = [OrderedDict(), OrderedDict()]
+        self.dispatcher: Optional[asyncio.Task] = None
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens: int, now: float) -> None:
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(tokens, now)
+
+    def has_waiters(self) -> bool:
+        return any(self.queues)
+
+    # Следующий ожидающий: первый непустой приоритет, пользователи по кругу
+    def next_waiter(self) -> Optional[_Waiter]:
+        for users in self.queues:
+            while users:
+                user_key, waiters = next(iter(users.items()))
+                waiter = waiters[0]
+                if waiter.future.done():
+                    # Вызов отменён, пока ждал очереди
+                    waiters.popleft()
+                    if not waiters:
+                        del users[user_key]
+                    continue
+                return waiter
+        return None
+
+    def pop_waiter(self) -> None:
+        for users in self.queues:
+            if users:
+                user_key, waiters = next(iter(users.items()))
+                waiters.popleft()
+                del users[user_key]
+                if waiters:
+                    users[user_key] = waiters
+                return
+
+
+# Общий регулятор запросов к OpenAI: вызов ждёт, пока в ведрах модели
+# хватит запросов и токенов (с запасом headroom от квоты), очередь
+# распределяется честно между пользователями, а 429 с Retry-After
+# приостанавливает все вызовы этой модели, а не только повторённый
+class RateGovernor:
+    def __init__(
+        self,
+        limits: dict[str, list[int]] = set.rate_limits,
+        headroom: float = set.rate_limit_headroom,
+        retries: int = set.rate_limit_retries
+    ):
+        self.limits = limits
+        self.headroom = headroom
+        self.retries = retries
+        self.models: dict[str, _ModelLimiter] = {}
+
+    def _limiter(self, model: str) -> Optional[_ModelLimiter]:
+        limiter = self.models.get(model)
+        if limiter is None and model in self.limits:
+            rpm, tpm = self.limits[model]
+            limiter = _ModelLimiter(rpm, tpm, self.headroom)
+            self.models[model] = limiter
+        return limiter
+
+    async def acquire(self, model: str, user_id=None, tokens: int = 0, priority: int = INTERACTIVE) -> None:
+        limiter = self._limiter(model)
+        if limiter is None:
+            return
+        now = time.monotonic()
+        if not limiter.has_waiters() and limiter.wait_time(tokens, now) == 0:
+            limiter.take(tokens, now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        limiter.queues[priority].setdefault(str(user_id), deque()).append(_Waiter(future, tokens))
+        if limiter.dispatcher is None or limiter.dispatcher.done():
+            limiter.dispatcher = asyncio.create_task(self._dispatch(limiter))
+        await future
+
+    async def _dispatch(self, limiter: _ModelLimiter) -> None:
+        while (waiter := limiter.next_waiter()) is not None:
+            wait = limiter.wait_time(waiter.tokens, time.monotonic())
+            if wait > 0:
+                # За время ожидания может появиться более приоритетный вызов
+                await asyncio.sleep(min(wait, 0.5))
+                continue
+            limiter.pop_waiter()
+            limiter.take(waiter.tokens, time.monotonic())
+            waiter.future.set_result(None)
+
+    # Пауза для всех вызовов модели после ответа 429
+    def pause(self, model: str, seconds: float) -> None:
+        limiter = self._limiter(model)
+        if limiter is not None:
+            limiter.paused_until = max(limiter.paused_until, time.monotonic() + seconds)
+
+    # Вызов через регулятор с повтором после 429
+    async def call(self, model: str, request, user_id=None, tokens: int = 0, priority: int = INTERACTIVE):
+        for attempt in range(self.retries + 1):
+            await self.acquire(model, user_id, tokens, priority)
+            try:
+                return await request()
+            except RateLimitError as e:
+                if attempt == self.retries:
+                    raise
+                seconds = retry_after_seconds(e)
+                logging.warning(f"Лимит запросов {model} превышен, пауза {seconds:.1f} с")
+                self.pause(model, seconds)
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import PureWindowsPath
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+from sqlalchemy.exc import IntegrityError
+
+from config import set, ASSISTANT_NAME, ASSISTANT_INSTRUCTIONS, ASSISTANT_MODEL, ASSISTANT_TOOLS, VECTOR_STORE_NAME
+from src.models import OpenAIResource
+from src.database import SessionLocal
+
+ASSISTANT_KEY = "assistant"
+VECTOR_STORE_KEY = "vector_store"
+FILE_KEY_PREFIX = "file:"
+
+
+# Хэш описания ресурса: строки и структуры сериализуются в JSON с сортировкой ключей
+def content_hash(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Имя файла независимо от вида разделителей в пути
+def file_name(path: str) -> str:
+    return PureWindowsPath(path).name
+
+
+# Реестр ресурсов OpenAI (ассистент, векторное хранилище, файлы базы знаний).
+# Идентификаторы и хэши содержимого хранятся в БД, общей для всех реплик:
+# при старте ресурсы переиспользуются, обновляется только то, что изменилось.
+# Проверка выполняется один раз за процесс при первом обращении.
+class ResourceRegistry:
+    def __init__(self, client, knowledge_files: Optional[list[str]] = None):
+        self.client = client
+        self.knowledge_files = list(set.knowledge_files if knowledge_files is None else knowledge_files)
+        self.assistant_id: Optional[str] = None
+        self.vector_store_id: Optional[str] = None
+        # file_id -> имя файла для подписей цитат
+        self.file_names: dict[str, str] = {}
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    # Фоновая проверка ресурсов при запуске, не задерживающая начало polling
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._warm_up())
+
+    async def _warm_up(self) -> None:
+        try:
+            await self.get_assistant_id()
+        except Exception as e:
+            logging.error(f"Ошибка при подготовке ресурсов ассистента: {e}")
+
+    async def get_assistant_id(self) -> str:
+        if self.assistant_id is None:
+            async with self.lock:
+                if self.assistant_id is None:
+                    self.assistant_id = await self._sync()
+        return self.assistant_id
+
+    async def _sync(self) -> str:
+        records = await self._load()
+        self.vector_store_id = await self._ensure_vector_store(records)
+        await self._sync_files(records, self.vector_store_id)
+        return await self._ensure_assistant(records, self.vector_store_id)
+
+    async def _ensure_vector_store(self, records: dict) -> str:
+        digest = content_hash(VECTOR_STORE_NAME)
+        record = records.get(VECTOR_STORE_KEY)
+        if record is not None:
+            vector_store_id, stored_hash = record
+            if stored_hash != digest:
+                await self.client.beta.vector_stores.update(vector_store_id, name=VECTOR_STORE_NAME)
+                await self._claim(VECTOR_STORE_KEY, vector_store_id, vector_store_id, digest)
+            return vector_store_id
+
+        vector_store = await self.client.beta.vector_stores.create(name=VECTOR_STORE_NAME)
+        winner = await self._claim(VECTOR_STORE_KEY, None, vector_store.id, digest)
+        if winner != vector_store.id:
+            # Другая реплика создала хранилище раньше
+            await self.client.beta.vector_stores.delete(vector_store.id)
+        return winner
+
+    # Загрузка новых и изменённых файлов и удаление тех, что убраны из настроек.
+    # Сбой одного файла не мешает остальным и ассистенту: у изменённого файла
+    # остаётся прежняя версия, новый повторится при следующем запуске
+    async def _sync_files(self, records: dict, vector_store_id: str) -> None:
+        hashes = await asyncio.gather(
+            *(asyncio.to_thread(file_hash, path) for path in self.knowledge_files),
+            return_exceptions=True
+        )
+        tasks = []
+        uploads = []
+        for path, digest in zip(self.knowledge_files, hashes):
+            key = FILE_KEY_PREFIX + path
+            record = records.get(key)
+            if isinstance(digest, Exception):
+                logging.error(f"Ошибка при чтении файла базы знаний {path}: {digest}")
+                if record is not None:
+                    self.file_names[record[0]] = file_name(path)
+                continue
+            if record is not None and record[1] == digest:
+                self.file_names[record[0]] = file_name(path)
+                continue
+            tasks.append(self._upload_file(key, path, digest, record[0] if record else None, vector_store_id))
+            uploads.append((path, record))
+
+        for key, (file_id, _) in records.items():
+            if key.startswith(FILE_KEY_PREFIX) and key[len(FILE_KEY_PREFIX):] not in self.knowledge_files:
+                tasks.append(self._remove_file(key, file_id, vector_store_id))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for (path, record), result in zip(uploads, results):
+            if isinstance(result, Exception):
+                logging.error(f"Ошибка при загрузке файла базы знаний {path}: {result}")
+                if record is not None:
+                    self.file_names[record[0]] = file_name(path)
+        for result in results[len(uploads):]:
+            if isinstance(result, Exception):
+                logging.error(f"Ошибка при удалении файла базы знаний: {result}")
+
+    async def _upload_file(self, key: str, path: str, digest: str, old_file_id: Optional[str], vector_store_id: str) -> None:
+        with open(path, "rb") as f:
+            uploaded = await self.client.files.create(file=f, purpose="assistants")
+        try:
+            await self.client.beta.vector_stores.files.create_and_poll(vector_store_id=vector_store_id, file_id=uploaded.id)
+        except Exception:
+            # Не прикреплённый к хранилищу файл не должен остаться в аккаунте
+            await self._delete_remote_file(vector_store_id, uploaded.id)
+            raise
+
+        winner = await self._claim(key, old_file_id, uploaded.id, digest)
+        if winner != uploaded.id:
+            # Файл уже обновила другая реплика
+            await self._delete_remote_file(vector_store_id, uploaded.id)
+        elif old_file_id is not None:
+            await self._delete_remote_file(vector_store_id, old_file_id)
+        self.file_names[winner] = file_name(path)
+        logging.info(f"Файл базы знаний {path} загружен: {winner}")
+
+    async def _remove_file(self, key: str, file_id: str, vector_store_id: str) -> None:
+        await self._delete_remote_file(vector_store_id, file_id)
+        try:
+            async with SessionLocal() as session:
+                async with session.begin():
+                    result = await session.execute(select(OpenAIResource).where(OpenAIResource.key == key))
+                    record = result.scalars().first()
+                    if record is not None:
+                        await session.delete(record)
+        except Exception as e:
+            logging.error(f"Ошибка при удалении записи {key} из реестра: {e}")
+
+    async def _delete_remote_file(self, vector_store_id: str, file_id: str) -> None:
+        try:
+            await self.client.beta.vector_stores.files.delete(file_id=file_id, vector_store_id=vector_store_id)
+            await self.client.files.delete(file_id)
+        except Exception as e:
+            logging.error(f"Ошибка при удалении файла {file_id}: {e}")
+
+    async def _ensure_assistant(self, records: dict, vector_store_id: str) -> str:
+        digest = content_hash(ASSISTANT_NAME, ASSISTANT_INSTRUCTIONS, ASSISTANT_MODEL, ASSISTANT_TOOLS, vector_store_id)
+        params = dict(
+            name=ASSISTANT_NAME,
+            instructions=ASSISTANT_INSTRUCTIONS,
+            model=ASSISTANT_MODEL,
+            tools=ASSISTANT_TOOLS,
+            tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}},
+        )
+        record = records.get(ASSISTANT_KEY)
+        if record is not None:
+            assistant_id, stored_hash = record
+            if stored_hash != digest:
+                await self.client.beta.assistants.update(assistant_id, **params)
+                await self._claim(ASSISTANT_KEY, assistant_id, assistant_id, digest)
+                logging.info(f"Ассистент {assistant_id} обновлён")
+            return assistant_id
+
+        assistant = await self.client.beta.assistants.create(**params)
+        winner = await self._claim(ASSISTANT_KEY, None, assistant.id, digest)
+        if winner != assistant.id:
+            await self.client.beta.assistants.delete(assistant.id)
+        logging.info(f"Ассистент создан: {winner}")
+        return winner
+
+    # Записи реестра: key -> (resource_id, content_hash)
+    async def _load(self) -> dict:
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(select(OpenAIResource))
+                return {record.key: (record.resource_id, record.content_hash) for record in result.scalars()}
+        except Exception as e:
+            # Без БД ресурсы создаются заново и живут только в памяти процесса
+            logging.error(f"Ошибка при загрузке реестра ресурсов: {e}")
+            return {}
+
+    # Запись ресурса с проверкой, что его не изменил кто-то другой:
+    # новая запись вставляется, существующая обновляется только если в ней
+    # всё ещё old_id. Возвращает идентификатор, оказавшийся в реестре.
+    async def _claim(self, key: str, old_id: Optional[str], new_id: str, digest: str) -> str:
+        try:
+            async with SessionLocal() as session:
+                async with session.begin():
+                    if old_id is None:
+                        session.add(OpenAIResource(key=key, resource_id=new_id, content_hash=digest))
+                        return new_id
+                    result = await session.execute(
+                        update(OpenAIResource)
+                        .where(OpenAIResource.key == key, OpenAIResource.resource_id == old_id)
+                        .values(resource_id=new_id, content_hash=digest)
+                    )
+                    if result.rowcount:
+                        return new_id
+        except IntegrityError:
+            pass
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении ресурса {key} в реестре: {e}")
+            return new_id
+
+        async with SessionLocal() as session:
+            result = await session.execute(select(OpenAIResource.resource_id).where(OpenAIResource.key == key))
+            return result.scalars().first() or new_id
@@ -0,0 +1,34 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+# Кэш результатов обработки файлов Telegram по file_unique_id: идентификатор
+# один и тот же у пересланных и повторно отправленных файлов, поэтому
+# повтор не требует обращения к OpenAI. LRU с TTL.
+class ResultCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Optional[str]) -> Optional[Any]:
+        if key is None:
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Optional[str], value: Any) -> None:
+        if key is None:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy.future import select
+from sqlalchemy.exc import IntegrityError
+
+from config import set
+from src.models import UserThread
+from src.database import SessionLocal
+
+# Треды ассистента по пользователям: соответствие telegram_id -> thread_id
+# хранится в БД, а недавно активные пользователи держатся в LRU-кэше в памяти
+class ThreadManager:
+    def __init__(self, client, cache_size: int = set.thread_cache_size):
+        self.client = client
+        self.cache_size = cache_size
+        self.threads: OrderedDict[str, str] = OrderedDict()
+        # Блокировка живёт, пока её кто-то держит или ждёт
+        self.locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    # Блокировка пользователя: в треде OpenAI может выполняться только один run,
+    # поэтому сообщения одного пользователя обрабатываются по очереди,
+    # а разных пользователей - параллельно
+    def lock(self, telegram_id: str) -> asyncio.Lock:
+        lock = self.locks.get(telegram_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[telegram_id] = lock
+        return lock
+
+    # Получение треда пользователя (из кэша, из БД или создание нового)
+    async def get_thread_id(self, telegram_id: str) -> str:
+        thread_id = self.threads.get(telegram_id)
+        if thread_id is not None:
+            self.threads.move_to_end(telegram_id)
+            return thread_id
+
+        try:
+            thread_id = await self._load(telegram_id)
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке треда для telegram_id={telegram_id}: {e}")
+
+        if thread_id is None:
+            thread = await self.client.beta.threads.create()
+            thread_id = await self._save(telegram_id, thread.id)
+
+        self._remember(telegram_id, thread_id)
+        return thread_id
+
+    def _remember(self, telegram_id: str, thread_id: str) -> None:
+        self.threads[telegram_id] = thread_id
+        self.threads.move_to_end(telegram_id)
+        while len(self.threads) > self.cache_size:
+            self.threads.popitem(last=False)
+
+    async def _load(self, telegram_id: str):
+        async with SessionLocal() as session:
+            result = await session.execute(
+                select(UserThread.thread_id).where(UserThread.telegram_id == telegram_id)
+            )
+            return result.scalars().first()
+
+    # Сохранение треда; если другой процесс успел раньше, используется его тред
+    async def _save(self, telegram_id: str, thread_id: str) -> str:
+        try:
+            async with SessionLocal() as session:
+                async with session.begin():
+                    session.add(UserThread(telegram_id=telegram_id, thread_id=thread_id))
+        except IntegrityError:
+            existing = await self._load(telegram_id)
+            if existing is not None:
+                return existing
+        except Exception as e:
+            # Без БД бот продолжает работать, тред живёт только в памяти процесса
+            logging.error(f"Ошибка при сохранении треда для telegram_id={telegram_id}: {e}")
+        return thread_id
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from config import set
+
+# Кэш синтезированной речи по хэшу (текст, голос, модель): звук хранится
+# на диске с ограничением общего размера и вытеснением давно не
+# использованных записей, а file_id из Telegram позволяет отправлять
+# повтор без синтеза и без повторной загрузки файла. Кэшируются только
+# повторяющиеся фразы: до min_repeats повторов считается лишь хэш текста.
+# Индекс file_id живёт в памяти и сохраняется на диск периодически и при остановке.
+class VoiceCache:
+    def __init__(
+        self,
+        path: str = set.tts_cache_dir,
+        max_bytes: int = set.tts_cache_max_bytes,
+        min_repeats: int = set.tts_cache_min_repeats,
+        counter_size: int = set.tts_cache_counter_size,
+        flush_interval: float = set.tts_cache_index_flush_interval
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_repeats = min_repeats
+        self.counter_size = counter_size
+        self.flush_interval = flush_interval
+        self.entries: OrderedDict[str, int] = OrderedDict()  # key -> размер файла, в порядке использования
+        self.file_ids: dict[str, str] = {}
+        self.seen: OrderedDict[str, int] = OrderedDict()  # key -> сколько раз фраза встречалась
+        self.total_bytes = 0
+        self.loaded = False
+        self.index_dirty = False
+        # Работа с файлами идёт в отдельных потоках, но по одной операции за раз
+        self.lock = asyncio.Lock()
+        self.stopping = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        return hashlib.sha256(json.dumps([text, voice, model], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _audio_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.ogg")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.path, "file_ids.json")
+
+    # Чтение состояния с диска при первом обращении
+    def _load(self) -> None:
+        if self.loaded:
+            return
+        self.loaded = True
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith(".ogg"):
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        try:
+            with open(self._index_path(), encoding='utf-8') as f:
+                # Записанные до чтения индекса file_id новее сохранённых
+                self.file_ids = {**json.load(f), **self.file_ids}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Ошибка при чтении индекса кэша голоса: {e}")
+
+    def _save_index(self, file_ids: dict[str, str]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self._index_path()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(file_ids, f)
+        os.replace(temp_path, self._index_path())
+
+    def _read(self, key: str) -> Optional[bytes]:
+        self._load()
+        if key not in self.entries:
+            return None
+        try:
+            with open(self._audio_path(key), 'rb') as f:
+                audio = f.read()
+        except FileNotFoundError:
+            self.total_bytes -= self.entries.pop(key)
+            return None
+        # Время изменения файла хранит порядок использования между перезапусками
+        os.utime(self._audio_path(key))
+        self.entries.move_to_end(key)
+        return audio
+
+    def _write(self, key: str, audio: bytes) -> None:
+        self._load()
+        temp_path = f"{self._audio_path(key)}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(temp_path, self._audio_path(key))
+        self.total_bytes += len(audio) - self.entries.pop(key, 0)
+        self.entries[key] = len(audio)
+
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            evicted, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._audio_path(evicted))
+            except FileNotFoundError:
+                pass
+            if self.file_ids.pop(evicted, None) is not None:
+                self.index_dirty = True
+
+    async def _ensure_loaded(self) -> None:
+        if not self.loaded:
+            async with self.lock:
+                await asyncio.to_thread(self._load)
+
+    # Учёт повтора фразы; True, если она уже в кэше или встречалась
+    # достаточно часто, чтобы её туда положить
+    async def admit(self, key: str) -> bool:
+        await self._ensure_loaded()
+        if key in self.file_ids or key in self.entries:
+            return True
+        count = self.seen.pop(key, 0) + 1
+        self.seen[key] = count
+        while len(self.seen) > self.counter_size:
+            self.seen.popitem(last=False)
+        return count >= self.min_repeats
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+        await self._ensure_loaded()
+        return self.file_ids.get(key)
+
+    def set_file_id(self, key: str, file_id: str) -> None:
+        self.file_ids[key] = file_id
+        self.index_dirty = True
+
+    # file_id больше недействителен (например, бот сменил токен)
+    def forget_file_id(self, key: str) -> None:
+        if self.file_ids.pop(key, None) is not None:
+            self.index_dirty = True
+
+    async def get_audio(self, key: str) -> Optional[bytes]:
+        async with self.lock:
+            return await asyncio.to_thread(self._read, key)
+
+    async def put_audio(self, key: str, audio: bytes) -> None:
+        async with self.lock:
+            await asyncio.to_thread(self._write, key, audio)
+
+    async def flush_index(self) -> None:
+        if not self.index_dirty:
+            return
+        self.index_dirty = False
+        try:
+            await asyncio.to_thread(self._save_index, dict(self.file_ids))
+        except Exception as e:
+            self.index_dirty = True
+            logging.error(f"Ошибка при сохранении индекса кэша голоса: {e}")
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    # Остановка с сохранением индекса; цикл не отменяется посреди записи
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.stopping.set()
+            await self.task
+            self.task = None
+        await self.flush_index()
+
+    async def _run(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush_index()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.future import select
+
+from config import set
+from src.models import UserValue
+from src.database import SessionLocal
+
+
+# Кэш ценностей пользователей для персонализации ответов: LRU с TTL,
+# промахи читаются из БД (один запрос на пользователя, даже если сообщений
+# несколько), после записи в БД записи пользователей сбрасываются.
+# Пользователи без ценностей тоже кэшируются, чтобы не ходить в БД на каждое сообщение.
+class UserValueCache:
+    def __init__(
+        self,
+        max_size: int = set.user_value_cache_size,
+        ttl: float = set.user_value_cache_ttl,
+        per_user: int = set.user_values_per_user
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.per_user = per_user
+        self.entries: OrderedDict[str, tuple[float, tuple[str, ...]]] = OrderedDict()
+        self.pending: dict[str, asyncio.Task] = {}
+        # Счётчик сбросов по пользователю: загрузка, во время которой был
+        # сброс, могла прочитать данные до записи и не кладётся в кэш
+        self.generations: dict[str, int] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def peek(self, telegram_id: str) -> Optional[tuple[str, ...]]:
+        entry = self.entries.get(telegram_id)
+        if entry is None:
+            return None
+        expires, values = entry
+        if expires < time.monotonic():
+            del self.entries[telegram_id]
+            return None
+        self.entries.move_to_end(telegram_id)
+        return values
+
+    async def get(self, telegram_id) -> tuple[str, ...]:
+        telegram_id = str(telegram_id)
+        values = self.peek(telegram_id)
+        if values is not None:
+            return values
+
+        task = self.pending.get(telegram_id)
+        if task is None:
+            task = asyncio.create_task(self._load(telegram_id))
+            self.pending[telegram_id] = task
+            task.add_done_callback(lambda done: self._forget(telegram_id, done))
+        return await asyncio.shield(task)
+
+    def _put(self, telegram_id: str, values: tuple[str, ...]) -> None:
+        self.entries[telegram_id] = (time.monotonic() + self.ttl, values)
+        self.entries.move_to_end(telegram_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _forget(self, telegram_id: str, task: asyncio.Task) -> None:
+        if self.pending.get(telegram_id) is task:
+            del self.pending[telegram_id]
+
+    # Сброс записей после записи новых ценностей (подписчик UserValueWriter).
+    # Идущая загрузка больше не раздаётся: следующий запрос прочитает БД заново.
+    def invalidate(self, telegram_ids: list[str]) -> None:
+        for telegram_id in telegram_ids:
+            self.entries.pop(telegram_id, None)
+            self.pending.pop(telegram_id, None)
+            self.generations[telegram_id] = self.generations.get(telegram_id, 0) + 1
+
+    async def _load(self, telegram_id: str) -> tuple[str, ...]:
+        generation = self.generations.get(telegram_id, 0)
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(UserValue.value)
+                    .where(UserValue.telegram_id == telegram_id)
+                    .order_by(UserValue.created_at.desc())
+                    .limit(self.per_user)
+                )
+                values = tuple(result.scalars())
+        except Exception as e:
+            # Без БД ответы просто не персонализируются
+            logging.error(f"Ошибка при загрузке ценностей для telegram_id={telegram_id}: {e}")
+            values = ()
+        if self.generations.get(telegram_id, 0) == generation:
+            self._put(telegram_id, values)
+        return values
+
+    # Фоновый прогрев при запуске
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.warm_up())
+
+    # Загрузка ценностей недавно активных пользователей одним запросом
+    async def warm_up(self, rows: int = set.user_value_warm_rows) -> None:
+        generations = dict(self.generations)
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(UserValue.telegram_id, UserValue.value)
+                    .order_by(UserValue.created_at.desc())
+                    .limit(rows)
+                )
+                grouped: dict[str, list[str]] = {}
+                for telegram_id, value in result:
+                    values = grouped.setdefault(telegram_id, [])
+                    if len(values) < self.per_user:
+                        values.append(value)
+        except Exception as e:
+            logging.error(f"Ошибка при прогреве кэша ценностей: {e}")
+            return
+
+        # Самые активные пользователи добавляются последними, чтобы LRU вытеснял других
+        for telegram_id, values in reversed(list(grouped.items())[:self.max_size]):
+            if self.generations.get(telegram_id, 0) == generations.get(telegram_id, 0):
+                self._put(telegram_id, tuple(values))
+        logging.info(f"Кэш ценностей прогрет: {len(grouped)} пользователей")
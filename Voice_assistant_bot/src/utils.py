@@ -1,34 +1,86 @@
+import asyncio
+import io
 import logging
-import tempfile
-import os
+import re
 import json
+from tempfile import SpooledTemporaryFile
 from typing import Optional
 
-from aiofiles import open as aio_open
-from aiohttp import ClientSession
-from aiogram.types import FSInputFile
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import BufferedInputFile
 
 from openai import AsyncOpenAI
 
-from amplitude import Amplitude, BaseEvent
-
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.exc import IntegrityError
-
 from typing_extensions import override
 
-from config import set, bot_tg, thread, assistant, executor
-from src.models import User, UserValue
-from src.database import SessionLocal, engine, Base
+from config import set, bot_tg, ASSISTANT_MODEL
+from src.database import engine, Base
+from src.threads import ThreadManager
+from src.ogg import concat_opus, split_opus
+from src.http_client import get_http_session
+from src.tts_cache import VoiceCache
+from src.registry import ResourceRegistry
+from src.citations import FileNameCache, apply_annotations, cited_file_ids
+from src.analytics import EventQueue
+from src.persistence import UserValueWriter
+from src.user_values import UserValueCache
+from src.rate_limit import RateGovernor, BACKGROUND, estimate_tokens
+from src.hedging import Endpoint
+from src.result_cache import ResultCache
+from src.photos import pick_photo_size, downscale_image, image_data_url
 
 client = AsyncOpenAI(
     api_key=set.openai_api_key
 )
 
+# Клиент для вызовов через регулятор: 429 повторяет регулятор, а сбои - Endpoint,
+# поэтому собственные повторы SDK отключены только у него
+governed_client = client.with_options(max_retries=0)
+
+governor = RateGovernor()
+
+# Внешние методы с дублированием медленных запросов и повторами после сбоев
+telegram_files = Endpoint("telegram.files")
+transcriptions = Endpoint("audio.transcriptions")
+speech = Endpoint("audio.speech", deadline=set.speech_deadline)
+vision = Endpoint("chat.completions.vision")
+completions = Endpoint("chat.completions")
+runs = Endpoint("beta.threads.runs")
+
 TOKEN = set.telegram_bot_token
 
-amp_client = Amplitude(api_key=set.amplitude_api_key)
+analytics = EventQueue()
+
+value_writer = UserValueWriter()
+
+value_cache = UserValueCache()
+value_writer.listeners.append(value_cache.invalidate)
+
+thread_manager = ThreadManager(client)
+
+registry = ResourceRegistry(client)
+
+file_names = FileNameCache(client)
+
+voice_cache = VoiceCache()
+
+photo_results = ResultCache(set.photo_cache_size, set.photo_cache_ttl)
+
+transcripts = ResultCache(set.transcript_cache_size, set.transcript_cache_ttl)
+
+# Модель и голос синтеза речи
+TTS_MODEL = "tts-1"
+TTS_VOICE = "onyx"
+
+# Дополнительные инструкции для каждого run
+RUN_INSTRUCTIONS = "Please address the user as Jane Doe. The user has a premium account."
+
+# Оценка токенов run сверх текста сообщения (история треда, инструкции, результаты поиска)
+RUN_TOKENS_ESTIMATE = 2000
+
+# Граница предложения и служебные метки цитат в тексте ассистента
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+CITATION_MARK = re.compile(r'【[^】]*】')
     
 # Получение файла по ID
 async def get_file_path(file_id: str) -> Optional[str]:
@@ -39,164 +91,180 @@ async def get_file_path(file_id: str) -> Optional[str]:
         logging.error(f"Ошибка при получении пути к файлу: {e}")
         return None
 
-# Скачивание файла во временное хранилище
-async def download_file(file_url: str, suffix: str) -> Optional[str]:
+# Скачивание файла в буфер: в памяти, а свыше voice_spool_threshold байт - на диске
+async def download_file(file_url: str) -> Optional[SpooledTemporaryFile]:
+    # У каждой попытки свой буфер, поэтому дубль медленной загрузки не мешает первой
+    async def fetch() -> SpooledTemporaryFile:
+        session = await get_http_session()
+        async with session.get(file_url, raise_for_status=True) as response:
+            buffer = SpooledTemporaryFile(max_size=set.voice_spool_threshold)
+            try:
+                async for chunk in response.content.iter_chunked(set.http_chunk_size):
+                    buffer.write(chunk)
+            except BaseException:
+                buffer.close()
+                raise
+            buffer.seek(0)
+            return buffer
+
     try:
-        async with ClientSession() as session:
-            async with session.get(file_url) as response:
-                if response.status == 200:
-                    temp_file_path = tempfile.mktemp(suffix=suffix)
-                    async with aio_open(temp_file_path, 'wb') as temp_file:
-                        await temp_file.write(await response.read())
-                    return temp_file_path
-                else:
-                    logging.error(f"Ошибка при скачивании файла: {response.status}")
-                    return None
+        return await telegram_files.call(fetch)
     except Exception as e:
-        logging.error(f"Ошибка при скачивании файла: {e}")
+        logging.error(f"Ошибка при скачивании файла: {e!r}")
         return None
 
+# Распознавание одного файла Ogg/Opus: байты или файл, сброшенный на диск.
+# Файл читают попытки по очереди с начала, поэтому он не дублируется.
+async def transcribe_audio(audio, user_id=None) -> str:
+    async def request():
+        if not isinstance(audio, bytes):
+            audio.seek(0)
+        # Имя файла нужно Whisper только для определения формата
+        return await governed_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=("voice.ogg", audio)
+        )
+
+    # Дубли и повторы выполняются внутри слота регулятора, поэтому срок и
+    # статистика задержек не включают ожидание в очереди квоты
+    transcription = await governor.call(
+        "whisper-1",
+        lambda: transcriptions.call(request, hedge=isinstance(audio, bytes)),
+        user_id
+    )
+    return transcription.text
+
 # Преобразование голоса в текст
-async def convert_voice_to_text(file_id: str) -> str:
+# Результат кэшируется по file_unique_id, поэтому пересланное голосовое не
+# распознаётся повторно. Сообщения длиннее transcribe_segment_min_seconds
+# делятся на части около transcribe_segment_seconds по тихим местам, части
+# распознаются параллельно и склеиваются по порядку.
+async def convert_voice_to_text(file_id: str, user_id=None, file_unique_id: Optional[str] = None, duration: Optional[int] = None) -> str:
+    cached = transcripts.get(file_unique_id)
+    if cached is not None:
+        return cached
+
     try:
         file_path = await get_file_path(file_id)
         if not file_path:
             return "Ошибка при получении пути к файлу."
 
         file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-        temp_file_path = await download_file(file_url, ".ogg")
-        if not temp_file_path:
+        audio_file = await download_file(file_url)
+        if audio_file is None:
             return "Ошибка при скачивании голосового сообщения."
         
-        with open(temp_file_path, "rb") as audio_file:
-            transcription = await client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
-        
-        return transcription.text
+        with audio_file:
+            # Файл больше voice_spool_threshold уже лежит на диске и
+            # отправляется целиком: деление требует держать поток в памяти
+            size = audio_file.seek(0, io.SEEK_END)
+            audio_file.seek(0)
+            if size > set.voice_spool_threshold:
+                segments = [audio_file]
+            else:
+                audio = audio_file.read()
+                segments = [audio]
+                if duration and duration > set.transcribe_segment_min_seconds:
+                    try:
+                        segments = await asyncio.to_thread(split_opus, audio, set.transcribe_segment_seconds, set.transcribe_search_seconds)
+                    except Exception as e:
+                        logging.error(f"Ошибка при делении голосового сообщения на части: {e}")
+
+            semaphore = asyncio.Semaphore(set.transcribe_workers)
+
+            async def transcribe_segment(segment) -> str:
+                async with semaphore:
+                    return await transcribe_audio(segment, user_id)
+
+            texts = await asyncio.gather(*(transcribe_segment(segment) for segment in segments))
+        text = " ".join(part.strip() for part in texts if part.strip())
+        transcripts.put(file_unique_id, text)
+        return text
+    except asyncio.TimeoutError:
+        logging.error("Распознавание речи не уложилось в срок запроса")
+        return "Распознавание речи заняло слишком много времени, попробуйте ещё раз."
     except Exception as e:
         logging.error(f"Ошибка при конвертации голосового сообщения в текст: {e}")
         return "Ошибка при конвертации голосового сообщения в текст."
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+
+# Инструкции run с сохранёнными ценностями пользователя (из кэша, без запроса к БД на каждое сообщение)
+async def run_instructions(user_id) -> str:
+    values = await value_cache.get(user_id)
+    if not values:
+        return RUN_INSTRUCTIONS
+    return f"{RUN_INSTRUCTIONS} Values and opinions important to the user: {'; '.join(values)}."
 
 # Взаимодействие с ассистентом  
 async def get_ai_response(text: str, user_id) -> str:
+    telegram_id = str(user_id)
+    try:
+        # У каждого пользователя свой тред, runs разных пользователей идут параллельно
+        async with thread_manager.lock(telegram_id):
+            thread_id = await thread_manager.get_thread_id(telegram_id)
+            return await run_assistant(text, user_id, thread_id)
+    except Exception as e:
+        logging.error(f"Ошибка при получении ответа от AI: {e}")
+        return "Ошибка при получении ответа от AI."
+
+# Выполнение run ассистента в треде пользователя
+async def run_assistant(text: str, user_id, thread_id: str) -> str:
     try:
         # Создание сообщения пользователя
         message = await client.beta.threads.messages.create(
-            thread_id=thread.id,
+            thread_id=thread_id,
             role="user",
             content=text
         )
 
         # Создание и ожидание завершения выполнения
-        run = await client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=assistant.id,
-            instructions="Please address the user as Jane Doe. The user has a premium account."
-        )   
+        assistant_id = await registry.get_assistant_id()
+        instructions = await run_instructions(user_id)
+        tokens = estimate_tokens(text) + RUN_TOKENS_ESTIMATE
+        # Через регулятор идёт только создание run, опрос статуса - обычный клиент с повторами SDK
+        run = await governor.call(
+            ASSISTANT_MODEL,
+            lambda: runs.call(lambda: governed_client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                instructions=instructions
+            ), hedge=False),
+            user_id,
+            tokens
+        )
+        run = await client.beta.threads.runs.poll(run.id, thread_id=thread_id)
         print(run.status)    
 
         if run.status == 'requires_action': 
-            # Define the list to store tool outputs
-            tool_outputs = []
+            tool_outputs = await collect_tool_outputs(run.required_action.submit_tool_outputs.tool_calls, user_id)
             
-            # Loop through each tool in the required action section
-            for tool in run.required_action.submit_tool_outputs.tool_calls:
-                if tool.function.name == "save_value":
-                    print("Ценность определена")
-                    # Получение данных из ответа функции
-                    try:
-                        json_string = str(tool.function)
-                        start_index = json_string.find('{')
-                        end_index = json_string.rfind('}')
-                        if start_index != -1 and end_index != -1 and end_index > start_index:
-                            extracted_text = json_string[start_index + 1:end_index]
-                        json_data = json.loads('{' + extracted_text + '}')
-                        opinions = json_data['opinions']
-                        values = json_data['values']
-                        
-                        # Сохранение ценности в БД
-                        validation_result = await validate_value(opinions)
-                        telegram_id = str(user_id)
-                        if validation_result == True:
-                            print("Ценность подтверждена")
-                            
-                            # Отправка сообщения в amplitude
-                            event_type = "ValueAnalysis"
-                            event = {
-                                "keywords": ["value", "analysis"],
-                                "likes": True
-                            }
-                            
-                            # Закоменчено так как бот работает только с VPN, а БД не поддерживает
-                            # Сохранение значений в БД
-                            # await create_tables()
-                            # Пример добавления данных
-                            # await add_user_value(telegram_id, values)
-                        
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding function date: {e}")
-
-                    except KeyError as e:
-                        print(f"KeyError: {e}. Function date does not contain expected keys.")
-                
-                tool_outputs.append({
-                    "tool_call_id": tool.id,
-                    "output": "Хорошо я запомнил ваше предпочтение, что это ваша ценность."
-                }) 
-                
-                # Submit all tool outputs at once after collecting them in a list
-                if tool_outputs:
-                    try:
-                        run = await client.beta.threads.runs.submit_tool_outputs_and_poll(
-                        thread_id=thread.id,
-                        run_id=run.id,
-                        tool_outputs=tool_outputs
-                        )
-                        print("Tool outputs submitted successfully.")
-                    except Exception as e:
-                        print("Failed to submit tool outputs:", e)
-                else:
-                    print("No tool outputs to submit.")
-                
-                if run.status == 'completed':
-                    messages = await client.beta.threads.messages.list(
-                        thread_id=thread.id
+            # Submit all tool outputs at once after collecting them in a list
+            if tool_outputs:
+                try:
+                    run_id = run.id
+                    run = await governor.call(
+                        ASSISTANT_MODEL,
+                        lambda: runs.call(lambda: governed_client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run_id,
+                            tool_outputs=tool_outputs
+                        ), hedge=False),
+                        user_id,
+                        RUN_TOKENS_ESTIMATE
                     )
-                    # assistants_response = messages.data[0].content[0].text.value
-                    assistants_response = messages.data[0].content[0].text
-                    
-                    annotations = assistants_response.annotations
-                    citations = []
-                    for index, annotation in enumerate(annotations):
-                        assistants_response.value = assistants_response.value.replace(annotation.text, f"[{index}]")
-                        if file_citation := getattr(annotation, "file_citation", None):
-                            cited_file = await client.files.retrieve(file_citation.file_id)
-                            citations.append(f"[{index}] {cited_file.filename}")
-                    combined_output = f"{assistants_response.value}\n\n" + "\n".join(citations)
-                    return combined_output
-                else:
-                    print(run.status)
-                    
-        elif run.status == 'completed':   
-            # Получение списка сообщений
-            messages = await client.beta.threads.messages.list(thread_id=thread.id)
-            # assistants_response = messages.data[0].content[0].text.value
-            assistants_response = messages.data[0].content[0].text
+                    run = await client.beta.threads.runs.poll(run.id, thread_id=thread_id)
+                    print("Tool outputs submitted successfully.")
+                except Exception as e:
+                    print("Failed to submit tool outputs:", e)
+            else:
+                print("No tool outputs to submit.")
             
-            annotations = assistants_response.annotations
-            citations = []
-            for index, annotation in enumerate(annotations):
-                assistants_response.value = assistants_response.value.replace(annotation.text, f"[{index}]")
-                if file_citation := getattr(annotation, "file_citation", None):
-                    cited_file = await client.files.retrieve(file_citation.file_id)
-                    citations.append(f"[{index}] {cited_file.filename}")
-            combined_output = f"{assistants_response.value}\n\n" + "\n".join(citations)
-            return combined_output
+            if run.status == 'completed':
+                return await read_assistant_answer(thread_id)
+            else:
+                print(run.status)
+                
+        elif run.status == 'completed':   
+            return await read_assistant_answer(thread_id)
         else:
             raise Exception("Run status is not 'completed' and requires further investigation.")
             
@@ -204,38 +272,345 @@ async def get_ai_response(text: str, user_id) -> str:
         logging.error(f"Ошибка при получении ответа от AI: {e}")
         return "Ошибка при получении ответа от AI."
 
+# Последний ответ ассистента в треде с подписями цитируемых файлов
+async def read_assistant_answer(thread_id: str) -> str:
+    messages = await client.beta.threads.messages.list(thread_id=thread_id)
+    assistants_response = messages.data[0].content[0].text
+    names = await file_names.resolve(cited_file_ids(assistants_response.annotations))
+    value, citations = apply_annotations(assistants_response.value, assistants_response.annotations, names)
+    return f"{value}\n\n" + "\n".join(citations)
+
+
+# Обработка вызовов функций ассистента, возвращает ответы для submit_tool_outputs
+async def collect_tool_outputs(tool_calls, user_id) -> list:
+    # Define the list to store tool outputs
+    tool_outputs = []
+    
+    # Loop through each tool in the required action section
+    for tool in tool_calls:
+        if tool.function.name == "save_value":
+            print("Ценность определена")
+            # Получение данных из ответа функции
+            try:
+                json_string = str(tool.function)
+                start_index = json_string.find('{')
+                end_index = json_string.rfind('}')
+                if start_index != -1 and end_index != -1 and end_index > start_index:
+                    extracted_text = json_string[start_index + 1:end_index]
+                json_data = json.loads('{' + extracted_text + '}')
+                opinions = json_data['opinions']
+                values = json_data['values']
+                
+                # Сохранение ценности в БД
+                validation_result = await validate_value(opinions, user_id)
+                telegram_id = str(user_id)
+                if validation_result == True:
+                    print("Ценность подтверждена")
+                    
+                    # Отправка сообщения в amplitude
+                    event_type = "ValueAnalysis"
+                    event = {
+                        "keywords": ["value", "analysis"],
+                        "likes": True
+                    }
+                    await analytics.track(telegram_id, telegram_id, event_type, event)
+                    
+                    # Запись отложенная: недоступность БД не задерживает ответ
+                    for value in values:
+                        save_user_value(telegram_id, value)
+                
+            except json.JSONDecodeError as e:
+                print(f"Error decoding function date: {e}")
+
+            except KeyError as e:
+                print(f"KeyError: {e}. Function date does not contain expected keys.")
+        
+        tool_outputs.append({
+            "tool_call_id": tool.id,
+            "output": "Хорошо я запомнил ваше предпочтение, что это ваша ценность."
+        }) 
+        
+
+    return tool_outputs
+
+# Выделение готовых предложений из накопленного текста; короткие
+# предложения склеиваются со следующими, чтобы не синтезировать обрывки
+def split_sentences(buffer: str, min_chars: int = set.tts_min_sentence_chars) -> tuple[list[str], str]:
+    parts = SENTENCE_END.split(buffer)
+    sentences = []
+    current = ""
+    for part in parts[:-1]:
+        current = f"{current} {part}" if current else part
+        if len(current) >= min_chars:
+            sentences.append(current)
+            current = ""
+    rest = f"{current} {parts[-1]}" if current else parts[-1]
+    return sentences, rest
+
+# Потоковый ответ ассистента: предложения отдаются по мере генерации
+async def stream_ai_response(text: str, user_id):
+    telegram_id = str(user_id)
+    async with thread_manager.lock(telegram_id):
+        thread_id = await thread_manager.get_thread_id(telegram_id)
+        await client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=text
+        )
+
+        buffer = ""
+        citations = []
+        assistant_id = await registry.get_assistant_id()
+        instructions = await run_instructions(user_id)
+        await governor.acquire(ASSISTANT_MODEL, user_id, estimate_tokens(text) + RUN_TOKENS_ESTIMATE)
+        stream_manager = client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            instructions=instructions
+        )
+        # После вызова функции run продолжается в новом потоке событий
+        while stream_manager is not None:
+            async with stream_manager as stream:
+                stream_manager = None
+                async for event in stream:
+                    if event.event == 'thread.message.delta':
+                        for block in event.data.delta.content or []:
+                            if block.type == 'text' and block.text.value:
+                                buffer += block.text.value
+                                sentences, buffer = split_sentences(buffer)
+                                for sentence in sentences:
+                                    sentence = CITATION_MARK.sub('', sentence).strip()
+                                    if sentence:
+                                        yield sentence
+                    elif event.event == 'thread.message.completed':
+                        file_ids = [
+                            file_id
+                            for block in event.data.content if block.type == 'text'
+                            for file_id in cited_file_ids(block.text.annotations)
+                        ]
+                        names = await file_names.resolve(file_ids)
+                        for file_id in file_ids:
+                            citations.append(f"[{len(citations)}] {names[file_id]}")
+                    elif event.event == 'thread.run.requires_action':
+                        tool_outputs = await collect_tool_outputs(event.data.required_action.submit_tool_outputs.tool_calls, user_id)
+                        await governor.acquire(ASSISTANT_MODEL, user_id, RUN_TOKENS_ESTIMATE)
+                        stream_manager = client.beta.threads.runs.submit_tool_outputs_stream(
+                            thread_id=thread_id,
+                            run_id=event.data.id,
+                            tool_outputs=tool_outputs
+                        )
+                    elif event.event in ('thread.run.failed', 'thread.run.cancelled', 'thread.run.expired'):
+                        raise Exception(f"Run finished with status '{event.data.status}'.")
+
+        rest = CITATION_MARK.sub('', buffer).strip()
+        if rest:
+            yield rest
+        if citations:
+            yield "\n".join(citations)
+
+# Деление текста на куски не длиннее max_chars по границам предложений
+def split_text_chunks(text: str, max_chars: int = set.tts_chunk_chars) -> list[str]:
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END.split(text.strip()):
+        # Слишком длинное предложение режется по пробелам
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks or [text]
+
+# Синтез одного куска текста сразу в Ogg/Opus
+async def synthesize_speech(text: str, user_id=None) -> bytes:
+    response = await governor.call(
+        TTS_MODEL,
+        lambda: speech.call(lambda: governed_client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=TTS_VOICE,
+            input=text,
+            response_format="opus"
+        )),
+        user_id
+    )
+    return response.content
 
 # Конвертация теста в голос
-async def convert_text_to_voice(text: str) -> Optional[str]:
+# Длинный текст синтезируется параллельно по кускам, которые затем
+# склеиваются в одно голосовое сообщение в исходном порядке
+async def convert_text_to_voice(text: str, user_id=None) -> Optional[bytes]:
     try:
-        response = await client.audio.speech.create(
-            model="tts-1",
-            voice="onyx",
-            input=str(text)
-        )
-        
-        temp_file_path = tempfile.mktemp(suffix=".ogg")
-        async with aio_open(temp_file_path, 'wb') as temp_file:
-            response.stream_to_file(temp_file.name)
-    
-        return temp_file_path
+        chunks = split_text_chunks(str(text))
+        semaphore = asyncio.Semaphore(set.tts_workers)
+
+        async def synthesize_chunk(chunk: str) -> bytes:
+            async with semaphore:
+                return await synthesize_speech(chunk, user_id)
+
+        parts = await asyncio.gather(*(synthesize_chunk(chunk) for chunk in chunks))
+        return parts[0] if len(parts) == 1 else await asyncio.to_thread(concat_opus, parts)
     except Exception as e:
         logging.error(f"Ошибка при конвертации текста в голос: {e}")
         return None
 
-# Отправка голосового сообщения пользователю
-async def send_voice_message(chat_id: int, voice_path: str):
+# Отправка в Telegram с повтором: при превышении лимита частоты сообщений
+# Telegram отвечает RetryAfter, и запрос повторяется после указанной паузы
+async def send_with_retry(send):
+    for attempt in range(set.telegram_send_retries + 1):
+        try:
+            return await send()
+        except TelegramRetryAfter as e:
+            if attempt == set.telegram_send_retries:
+                raise
+            logging.warning(f"Лимит сообщений Telegram, повтор через {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+
+# Отправка голосового сообщения пользователю; возвращает отправленное
+# сообщение или None, если отправить не удалось
+async def send_voice_message(chat_id: int, voice: bytes):
     try:
-        voice_file = FSInputFile(voice_path)
-        await bot_tg.send_voice(chat_id=chat_id, voice=voice_file)
+        voice_file = BufferedInputFile(voice, filename="voice.ogg")
+        return await send_with_retry(lambda: bot_tg.send_voice(chat_id=chat_id, voice=voice_file))
     except Exception as e:
         logging.error(f"Ошибка при отправке голосового сообщения: {e}")
+        return None
+
+# Отправка текста пользователю, когда голосом ответить не получилось
+async def send_text_message(chat_id: int, text: str) -> None:
+    try:
+        await send_with_retry(lambda: bot_tg.send_message(chat_id, text))
+    except Exception as e:
+        logging.error(f"Ошибка при отправке текстового сообщения: {e}")
+
+# Отправка текста голосом. Короткие повторяющиеся фразы (фиксированные
+# ответы и сообщения об ошибках) берутся из кэша: повтор отправляется по
+# file_id без синтеза и загрузки. Ответы ассистента и анализ фото у каждого
+# пользователя свои и не повторяются, поэтому в кэш на диске не попадают.
+# Если голосовое не удалось отправить, ответ уходит текстом.
+# Возвращает False, если синтез не удался.
+async def send_voice_reply(chat_id: int, text: str) -> bool:
+    text = str(text)
+    key = voice_cache.key(text, TTS_VOICE, TTS_MODEL)
+    if len(text) > set.tts_cache_max_chars or not await voice_cache.admit(key):
+        voice = await convert_text_to_voice(text, chat_id)
+        if not voice:
+            return False
+        if not await send_voice_message(chat_id, voice):
+            await send_text_message(chat_id, text)
+        return True
+
+    file_id = await voice_cache.get_file_id(key)
+    if file_id:
+        try:
+            await send_with_retry(lambda: bot_tg.send_voice(chat_id=chat_id, voice=file_id))
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при отправке голосового сообщения по file_id: {e}")
+            voice_cache.forget_file_id(key)
+
+    voice = await voice_cache.get_audio(key)
+    if voice is None:
+        voice = await convert_text_to_voice(text, chat_id)
+        if not voice:
+            return False
+        await voice_cache.put_audio(key, voice)
+
+    sent = await send_voice_message(chat_id, voice)
+    if sent:
+        voice_cache.set_file_id(key, sent.voice.file_id)
+    else:
+        await send_text_message(chat_id, text)
+    return True
+
+# Голосовой ответ по предложениям: синтез начинается, пока ассистент ещё
+# генерирует текст, а отправка идёт строго по порядку. Чтобы не упираться
+# в лимит частоты сообщений Telegram, предложения склеиваются в одно
+# голосовое до tts_stream_group_chars символов или tts_stream_group_delay
+# секунд; первое отправляется сразу, чтобы ответ начинался без задержки.
+# Части, которые не удалось озвучить или отправить, уходят текстом на своём
+# месте, чтобы пользователь не остался без ответа.
+async def stream_voice_reply(chat_id: int, text: str, user_id) -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def send_in_order():
+        failed: list[str] = []
+        failures = 0
+        while (item := await queue.get()) is not None:
+            group, task = item
+            voice = await task
+            if voice:
+                if failed:
+                    await send_text_message(chat_id, " ".join(failed))
+                    failed = []
+                if await send_voice_message(chat_id, voice):
+                    continue
+            failed.append(group)
+            failures += 1
+        if failed:
+            await send_text_message(chat_id, " ".join(failed))
+        if failures:
+            logging.error(f"Не удалось озвучить или отправить частей ответа: {failures}, отправлены текстом")
+
+    group: list[str] = []
+    group_chars = 0
+    group_started = 0.0
+    first = True
+
+    async def flush():
+        nonlocal group, group_chars, first
+        if group:
+            joined = " ".join(group)
+            await queue.put((joined, asyncio.create_task(convert_text_to_voice(joined, user_id))))
+            group, group_chars, first = [], 0, False
+
+    sender = asyncio.create_task(send_in_order())
+    responses = stream_ai_response(text, user_id)
+    loop = asyncio.get_running_loop()
+    next_sentence = None
+    try:
+        while True:
+            if next_sentence is None:
+                next_sentence = asyncio.ensure_future(responses.__anext__())
+            # Пока ассистент молчит (например, вызывает функции), накопленное
+            # отправляется по истечении tts_stream_group_delay
+            timeout = None
+            if group:
+                timeout = max(0.0, group_started + set.tts_stream_group_delay - loop.time())
+            done, _ = await asyncio.wait({next_sentence}, timeout=timeout)
+            if not done:
+                await flush()
+                continue
+            task, next_sentence = next_sentence, None
+            try:
+                sentence = task.result()
+            except StopAsyncIteration:
+                break
+            if not group:
+                group_started = loop.time()
+            group.append(sentence)
+            group_chars += len(sentence)
+            if first or group_chars >= set.tts_stream_group_chars or loop.time() - group_started >= set.tts_stream_group_delay:
+                await flush()
+        await flush()
     finally:
-        if os.path.exists(voice_path):
-            os.remove(voice_path)
+        if next_sentence is not None:
+            next_sentence.cancel()
+            await asyncio.gather(next_sentence, return_exceptions=True)
+        await responses.aclose()
+        await queue.put(None)
+        await sender
 
 # Проверка ценности
-async def validate_value(value: str) -> bool:
+async def validate_value(value: str, user_id=None) -> bool:
     
     tools = [
         {
@@ -258,13 +633,20 @@ async def validate_value(value: str) -> bool:
         }
     ]
     
-    completion = await client.chat.completions.create(
-        model="gpt-4o",
-        messages = [
-            {"role": "system", "content": "You are a helpful customer support assistant. Use the supplied tools to assist the user."},
-            {"role": "user", "content": "{}".format(value)}
-        ],
-        tools=tools,
+    # Фоновая проверка уступает очередь ответам пользователям и не дублируется
+    completion = await governor.call(
+        "gpt-4o",
+        lambda: completions.call(lambda: governed_client.chat.completions.create(
+            model="gpt-4o",
+            messages = [
+                {"role": "system", "content": "You are a helpful customer support assistant. Use the supplied tools to assist the user."},
+                {"role": "user", "content": "{}".format(value)}
+            ],
+            tools=tools,
+        ), hedge=False),
+        user_id,
+        estimate_tokens(value) + 200,
+        BACKGROUND
     )
     
     if completion.choices[0].finish_reason == 'stop':
@@ -279,65 +661,66 @@ async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-# Добавление ценности
-async def add_user_value(telegram_id, value):
-    try:
-        async with SessionLocal() as session:
-            async with session.begin():
-                existing_record = await session.execute(
-                    select(UserValue).where(UserValue.telegram_id == telegram_id)
-                )
-                if existing_record.scalars().first():
-                    print(f"Record with telegram_id {telegram_id} already exists.")
-                else:
-                    new_value = UserValue(telegram_id=telegram_id, value=value)
-                    session.add(new_value)
-                    try:
-                        await session.commit()
-                    except IntegrityError:
-                        await session.rollback()
-                        print(f"Could not insert {telegram_id}: {value}")
-    except Exception as e:
-        logging.error(f"Ошибка при сохранении ценности для telegram_id={telegram_id}: {str(e)}")
-        raise
+# Добавление ценности: запись ставится в очередь и попадает в БД со следующей пачкой
+def save_user_value(telegram_id, value: str) -> None:
+    value_writer.save(telegram_id, value)
 
 # Aнализ эмоций на полученом фото
-async def analyze_photo(file_path):
+# Результат кэшируется по file_unique_id самого большого размера фото, так что
+# пересланное или повторно отправленное фото не анализируется заново.
+# Режимы photo_mode:
+#   url       - самый большой размер по ссылке Telegram, детализация по умолчанию
+#   size      - самый маленький размер, достаточный для лица, передаётся в запросе с детализацией photo_detail
+#   downscale - то же, но изображение дополнительно уменьшается локально (нужен Pillow)
+async def analyze_photo(photo_sizes, user_id=None) -> str:
+    cache_key = f"{set.photo_mode}:{photo_sizes[-1].file_unique_id}"
+    cached = photo_results.get(cache_key)
+    if cached is not None:
+        return cached
+
+    photo = photo_sizes[-1] if set.photo_mode == "url" else pick_photo_size(photo_sizes)
+    file_path = await get_file_path(photo.file_id)
+    if not file_path:
+        raise Exception("Не удалось получить путь к фото.")
     photo_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-    
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": "You need to determine whether there is a human face in the photo. If there is, then determine the emotions that the person is experiencing; if there is no face or it is impossible to determine the emotions, return only word False."},
+
+    if set.photo_mode == "url":
+        image_url = {"url": photo_url}
+        # Изображение в полной детализации считается примерно за 1000 токенов
+        tokens = 1000
+    else:
+        photo_file = await download_file(photo_url)
+        if photo_file is None:
+            raise Exception("Не удалось скачать фото.")
+        with photo_file:
+            data = photo_file.read()
+        if set.photo_mode == "downscale":
+            data = await asyncio.to_thread(downscale_image, data)
+        image_url = {"url": image_data_url(data), "detail": set.photo_detail}
+        tokens = 85 if set.photo_detail == "low" else 1000
+
+    response = await governor.call(
+        "gpt-4o",
+        lambda: vision.call(lambda: governed_client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
                 {
-                "type": "image_url",
-                "image_url": {
-                    "url": photo_url,
-                },
-                },
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "You need to determine whether there is a human face in the photo. If there is, then determine the emotions that the person is experiencing; if there is no face or it is impossible to determine the emotions, return only word False."},
+                    {
+                    "type": "image_url",
+                    "image_url": image_url,
+                    },
+                ],
+                }
             ],
-            }
-        ],
-        max_tokens=300,
+            max_tokens=300,
+        )),
+        user_id,
+        tokens + 300
     )
-    
-    return response.choices[0].message.content
 
-# Функция для отправки событий в Amplitude
-def send_event_to_amplitude(user_id, chat_id, event_type, event_properties):
-    try:
-        # Create a BaseEvent instance
-        event = BaseEvent(event_type=event_type, user_id=user_id, device_id=chat_id)
-        
-        # # Set event properties if provided
-        # if event_properties:
-        #     event["event_properties"] = event_properties
-        
-        # Отправляем событие в Amplitude
-        amp_client.track(event)
-        print(f"Событие типа '{event_type}' для пользователя {user_id} отправлено в Amplitude")
-    except Exception as e:
-        print(f"Ошибка при отправке события в Amplitude: {e}")
+    result = response.choices[0].message.content
+    photo_results.put(cache_key, result)
+    return result
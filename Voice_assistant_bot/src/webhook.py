@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import set
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Приём обновлений через webhook: запрос от Telegram подтверждается сразу,
+# а обновление ставится в ограниченную очередь, которую разбирают
+# webhook_workers обработчиков. При переполнении очереди отвечает 503, и
+# Telegram повторит доставку позже. При остановке новые обновления не
+# принимаются, а уже принятые дообрабатываются.
+class WebhookServer:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        queue_size: int = set.webhook_queue_size,
+        workers: int = set.webhook_workers,
+        drain_timeout: float = set.webhook_drain_timeout
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closing = False
+        self.stopped: Optional[asyncio.Event] = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if set.webhook_secret and request.headers.get(SECRET_HEADER) != set.webhook_secret:
+            return web.Response(status=401)
+        if self.closing:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            logging.warning("Очередь обновлений переполнена, Telegram повторит доставку")
+            return web.Response(status=503)
+        return web.Response()
+
+    # Проверка для балансировщика: при остановке экземпляр выводится из ротации
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(status=503 if self.closing else 200, text=f"queued={self.queue.qsize()}")
+
+    async def _worker(self) -> None:
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error(f"Ошибка при обработке обновления: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.stopped.set()
+
+    async def run(self) -> None:
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остановка по Ctrl+C через KeyboardInterrupt
+                pass
+
+        app = web.Application()
+        app.router.add_post(set.webhook_path, self.handle_update)
+        app.router.add_get("/healthz", self.health)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await web.TCPSite(runner, set.webhook_host, set.webhook_port).start()
+            if set.webhook_url:
+                await self.bot.set_webhook(
+                    url=set.webhook_url.rstrip("/") + set.webhook_path,
+                    secret_token=set.webhook_secret or None,
+                    allowed_updates=self.dp.resolve_used_update_types(),
+                    max_connections=set.webhook_max_connections
+                )
+            logging.info(f"Webhook слушает {set.webhook_host}:{set.webhook_port}{set.webhook_path}")
+            await self.stopped.wait()
+        finally:
+            self.closing = True
+            try:
+                await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Не обработано обновлений при остановке: {self.queue.qsize()}")
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await runner.cleanup()
+            await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+            await self.bot.session.close()
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+# Офлайн-бенчмарк конвейера CryptoAnalyzer: CoinGecko, NewsAPI и OpenAI
+# заменяются локальным aiohttp-сервером с настраиваемыми задержкой,
+# размером ответов и долей ошибок.
+#
+# Пример запуска:
+#   python crypto_benchmark.py --concurrency 1,10,100 --requests 200 --latency-ms 150 --error-rate 0.01
+
+USER_MESSAGES = [
+    "How much did bitcoin change in the last 7 days?",
+    "Насколько изменилась цена биткоина за последние 3 дня?",
+    "What do you think about the crypto market?",
+    "What can you do?",
+]
+
+
+# Локальная замена внешних API
+class FakeUpstream:
+    def __init__(self, latency_ms, jitter, error_rate, articles, price_step, description_bytes):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.articles = articles
+        self.price_step = price_step
+        self.description_bytes = description_bytes
+        self.calls = {'coingecko': 0, 'newsapi': 0, 'openai': 0}
+        self.runner = None
+        self.base_url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/coingecko/coins/{crypto_id}/market_chart/range', self.market_chart_range)
+        app.router.add_get('/newsapi/everything', self.everything)
+        app.router.add_post('/openai/chat/completions', self.chat_completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    # Задержка и случайная ошибка перед ответом; None если отвечать нормально
+    async def _delay(self, name):
+        self.calls[name] += 1
+        latency = self.latency_ms * (1 + random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(max(0, latency) / 1000)
+        if random.random() < self.error_rate:
+            return web.json_response({'error': {'message': 'Injected failure', 'type': 'server_error'}}, status=500)
+        return None
+
+    async def market_chart_range(self, request):
+        error = await self._delay('coingecko')
+        if error is not None:
+            return error
+        start = int(request.query['from'])
+        end = int(request.query['to'])
+        prices = [
+            [timestamp * 1000, 60000 + 500 * random.random()]
+            for timestamp in range(start, end, self.price_step)
+        ]
+        return web.json_response({'prices': prices})
+
+    async def everything(self, request):
+        error = await self._delay('newsapi')
+        if error is not None:
+            return error
+        query = request.query.get('q', 'bitcoin')
+        articles = [
+            {
+                'title': f"{query.capitalize()} headline {i} {random.getrandbits(32):08x}",
+                'description': 'x' * self.description_bytes,
+            }
+            for i in range(self.articles)
+        ]
+        return web.json_response({'status': 'ok', 'totalResults': len(articles), 'articles': articles})
+
+    async def chat_completions(self, request):
+        error = await self._delay('openai')
+        if error is not None:
+            return error
+        body = await request.json()
+        prompt = body['messages'][0]['content']
+        if body.get('functions'):
+            count = len(re.findall(r'^\d+\. "', prompt, re.MULTILINE))
+            arguments = json.dumps({
+                'sentiments': [{'index': i, 'sentiment': random.choice([-1, 0, 1])} for i in range(1, count + 1)]
+            })
+            message = {
+                'role': 'assistant',
+                'content': None,
+                'function_call': {'name': body['function_call']['name'], 'arguments': arguments},
+            }
+        else:
+            message = {'role': 'assistant', 'content': random.choice(['-1', '-2', '7'])}
+        return web.json_response({
+            'id': 'chatcmpl-benchmark',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'gpt-4'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+# Замена aiogram Message для вызова echo_handler без Telegram
+class FakeMessage:
+    def __init__(self, text=None, user_id=0):
+        self.text = text
+        self.from_user = FakeUser(user_id)
+        self.edits = 0
+
+    async def answer(self, text, **kwargs):
+        return FakeMessage(text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.edits += 1
+        return self
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# Прогон requests вызовов с ограничением одновременности
+async def run_level(call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+# Входные данные различаются от запроса к запросу, иначе внутри уровня
+# почти все вызовы попадают в ReportCache и SentimentCache и прогон
+# измеряет поиск в кэше, а не конвейер
+def make_targets(module, analyzer, articles, days):
+    async def analyze_user_message(i):
+        await analyzer.analyze_user_message(USER_MESSAGES[i % len(USER_MESSAGES)], i)
+
+    async def analyze_news_with_gpt4(i):
+        await analyzer.analyze_news_with_gpt4([
+            {'title': f"{article['title']} request {i}", 'description': article['description']}
+            for article in articles
+        ])
+
+    async def echo_handler(i):
+        await module.echo_handler(FakeMessage(f"How much did bitcoin change in the last {days + i} days?", i))
+
+    return {
+        'analyze_user_message': analyze_user_message,
+        'analyze_news_with_gpt4': analyze_news_with_gpt4,
+        'echo_handler': echo_handler,
+    }
+
+
+async def main(args):
+    upstream = FakeUpstream(args.latency_ms, args.jitter, args.error_rate, args.articles, args.price_step, args.description_bytes)
+    base_url = await upstream.start()
+
+    # Модуль читает адреса API из окружения при импорте
+    os.environ['COINGECKO_API_URL'] = f'{base_url}/coingecko'
+    os.environ['NEWS_API_URL'] = f'{base_url}/newsapi'
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('NEWS_API_KEY', 'benchmark')
+    os.environ.setdefault('PRICE_STORE_DIR', tempfile.mkdtemp(prefix='price_store_'))
+    # Квота OpenAI не ограничивает прогон, если не задана явно
+    os.environ.setdefault('OPENAI_RPM', '1000000')
+    os.environ.setdefault('OPENAI_TPM', '1000000000')
+    # Пауза между правками сообщения задала бы постоянный минимум задержки echo_handler
+    os.environ.setdefault('MESSAGE_EDIT_INTERVAL', '0')
+    import openai
+    import crypto_news_analyzer as module
+    openai.api_base = f'{base_url}/openai'
+
+    articles = [
+        {'title': f"Bitcoin benchmark headline {i}", 'description': 'x' * args.description_bytes}
+        for i in range(args.articles)
+    ]
+    targets = [name.strip() for name in args.targets.split(',')]
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    print(f"{'target':<24}{'conc':>6}{'req':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    analyzer = None
+    try:
+        for target in targets:
+            for level in levels:
+                # По умолчанию каждый уровень начинается с пустых кэшей
+                if analyzer is None or not args.warm:
+                    if analyzer is not None:
+                        await analyzer.close()
+                    analyzer = module.AsyncCryptoAnalyzer(
+                        openai_key='benchmark',
+                        news_api_key='benchmark',
+                        price_store=module.PriceStore(tempfile.mkdtemp(prefix='price_store_')),
+                    )
+                    await analyzer.start()
+                    module.async_crypto_analyzer = analyzer
+
+                call = make_targets(module, analyzer, articles, args.days)[target]
+                # Вывод бота идёт в stderr, чтобы не смешиваться с таблицей
+                with contextlib.redirect_stdout(sys.stderr):
+                    latencies, errors, elapsed = await run_level(call, args.requests, level)
+                print(
+                    f"{target:<24}{level:>6}{args.requests:>7}{errors:>6}"
+                    f"{percentile(latencies, 0.50) * 1000:>10.1f}"
+                    f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+                    f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+                    f"{args.requests / elapsed:>10.1f}"
+                )
+    finally:
+        if analyzer is not None:
+            await analyzer.close()
+        await upstream.stop()
+
+    print(f"\nUpstream calls: {upstream.calls}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the crypto analysis pipeline")
+    parser.add_argument('--targets', default='analyze_user_message,analyze_news_with_gpt4,echo_handler')
+    parser.add_argument('--concurrency', default='1,10,50,100', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per target and concurrency level")
+    parser.add_argument('--latency-ms', type=float, default=100, help="Mean fake upstream latency")
+    parser.add_argument('--jitter', type=float, default=0.5, help="Relative latency jitter, 0..1")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of upstream calls failing with HTTP 500")
+    parser.add_argument('--articles', type=int, default=100, help="Articles per NewsAPI response")
+    parser.add_argument('--description-bytes', type=int, default=500, help="Size of each article description")
+    parser.add_argument('--price-step', type=int, default=300, help="Seconds between generated price points")
+    parser.add_argument('--days', type=int, default=7, help="Period asked about in the first echo_handler message, each next one asks one day more")
+    parser.add_argument('--warm', action='store_true', help="Keep caches between concurrency levels")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,16 +1,36 @@
 import requests
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import openai
 
 import asyncio
 import logging
+import json
+import time
+import re
+import hashlib
+import random
+import signal
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import NamedTuple
+
+import numpy as np
+
+import aiohttp
+from aiohttp import web
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
-from aiogram.types import Message
+from aiogram.types import Message, Update
 
 import os
 from dotenv import load_dotenv
@@ -24,41 +44,751 @@ openai.api_key = os.getenv('OPENAI_API_KEY')
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 NEWS_API_KEY = os.getenv('NEWS_API_KEY')
 
+# Адреса внешних API
+COINGECKO_API_URL = os.getenv('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3')
+NEWS_API_URL = os.getenv('NEWS_API_URL', 'https://newsapi.org/v2')
+
+# Настройки общего пула HTTP-соединений
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '200'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '50'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '60'))
+
+# Локальное хранилище ценовых рядов
+PRICE_STORE_DIR = os.getenv('PRICE_STORE_DIR', '.price_store')
+# Через сколько секунд докачивать хвост ряда с CoinGecko
+PRICE_STORE_REFRESH = float(os.getenv('PRICE_STORE_REFRESH', '300'))
+# Наибольший участок одного запроса, дней: за период до 90 дней CoinGecko
+# отдаёт почасовые точки, за более длинный - дневные
+PRICE_STORE_CHUNK_DAYS = float(os.getenv('PRICE_STORE_CHUNK_DAYS', '89'))
+
+# Шаг общей временной сетки для пакетной аналитики цен, секунд
+PRICE_GRID_STEP = float(os.getenv('PRICE_GRID_STEP', '3600'))
+
+# Кэш сантиментов заголовков
+SENTIMENT_CACHE_TTL = float(os.getenv('SENTIMENT_CACHE_TTL', '86400'))
+SENTIMENT_CACHE_SIZE = int(os.getenv('SENTIMENT_CACHE_SIZE', '10000'))
+# Доля общих слов, начиная с которой два заголовка считаются дублями
+HEADLINE_DUPLICATE_THRESHOLD = float(os.getenv('HEADLINE_DUPLICATE_THRESHOLD', '0.8'))
+
+# Оценка сантиментов: бюджет токенов заголовков на один запрос и число одновременных запросов
+SENTIMENT_CHUNK_TOKENS = int(os.getenv('SENTIMENT_CHUNK_TOKENS', '1500'))
+SENTIMENT_CONCURRENCY = int(os.getenv('SENTIMENT_CONCURRENCY', '4'))
+
+# Кэш готовых отчётов: время жизни и ширина временной корзины ключа, секунд
+REPORT_CACHE_TTL = float(os.getenv('REPORT_CACHE_TTL', '300'))
+REPORT_CACHE_BUCKET = float(os.getenv('REPORT_CACHE_BUCKET', '300'))
+
+# Показ отчёта по частям и минимальный интервал между правками сообщения, секунд
+STREAM_REPLIES = os.getenv('STREAM_REPLIES', '1') == '1'
+MESSAGE_EDIT_INTERVAL = float(os.getenv('MESSAGE_EDIT_INTERVAL', '1.5'))
+
+# Режим получения обновлений (polling или webhook) и параметры webhook: публичный
+# адрес (пустой - setWebhook не вызывается), путь, адрес и порт сервера, секрет,
+# размер очереди обновлений, число обработчиков и время дообработки при остановке
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
+# Квота GPT-4: запросов и токенов в минуту, доля квоты, которую занимает бот,
+# и число повторов после ответа 429
+OPENAI_RPM = float(os.getenv('OPENAI_RPM', '500'))
+OPENAI_TPM = float(os.getenv('OPENAI_TPM', '10000'))
+OPENAI_RATE_HEADROOM = float(os.getenv('OPENAI_RATE_HEADROOM', '0.9'))
+OPENAI_RATE_RETRIES = int(os.getenv('OPENAI_RATE_RETRIES', '3'))
+
+# Дублирование медленных запросов и повторы: квантиль задержки для дубля, окно
+# статистики и минимум замеров, число попыток, границы задержки между попытками
+# и общий срок запроса, секунд
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', '200'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', '3'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.25'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '4'))
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '30'))
+
+# Приоритеты запросов к GPT-4: разбор сообщения пользователя идёт раньше оценки новостей
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Функция, через которую GPT-4 возвращает сантименты по номерам заголовков
+SENTIMENT_FUNCTION = {
+    "name": "report_sentiments",
+    "description": "Report the sentiment of every numbered news headline",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "sentiments": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "index": {
+                            "type": "integer",
+                            "description": "Number of the headline"
+                        },
+                        "sentiment": {
+                            "type": "integer",
+                            "enum": [-1, 0, 1],
+                            "description": "Positive (1), Neutral (0), Negative (-1)"
+                        }
+                    },
+                    "required": ["index", "sentiment"]
+                }
+            }
+        },
+        "required": ["sentiments"]
+    }
+}
+
+# Хранилище цен: для каждой криптовалюты два компактных столбца array('d')
+# (время в мс и цена), которые лежат на диске в виде сырых файлов.
+# С сети докачиваются только недостающие участки ряда, а окно любой
+# длины находится бинарным поиском по времени. Участки запрашиваются
+# кусками не длиннее chunk_days, поэтому в ряду нет дневных точек и
+# короткое окно не начинается на сутки позже, чем нужно.
+class PriceStore:
+    # Версия формата: ряды, сохранённые до загрузки кусками, могут
+    # содержать дневные точки и скачиваются заново
+    FORMAT = 2
+
+    def __init__(self, path=PRICE_STORE_DIR, refresh=PRICE_STORE_REFRESH, chunk_days=PRICE_STORE_CHUNK_DAYS):
+        self.path = path
+        self.refresh = refresh
+        self.chunk = chunk_days * 86400
+        self.series = {}   # crypto_id -> (timestamps, prices)
+        self.covered = {}  # crypto_id -> начало загруженного участка, сек
+        self.checked = {}  # crypto_id -> время последней докачки хвоста, сек
+
+    def _file(self, crypto_id, ext):
+        return os.path.join(self.path, f'{crypto_id}.{ext}')
+
+    # Загрузка ряда с диска (один раз на процесс)
+    def load(self, crypto_id):
+        if crypto_id not in self.series:
+            timestamps, prices = array('d'), array('d')
+            ts_path, px_path = self._file(crypto_id, 'ts'), self._file(crypto_id, 'px')
+            meta_path = self._file(crypto_id, 'json')
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            if os.path.exists(ts_path) and os.path.exists(px_path) and meta.get('format') == self.FORMAT:
+                # Недописанный хвост (например, после падения) отбрасывается
+                count = min(os.path.getsize(ts_path), os.path.getsize(px_path)) // timestamps.itemsize
+                with open(ts_path, 'rb') as f:
+                    timestamps.fromfile(f, count)
+                with open(px_path, 'rb') as f:
+                    prices.fromfile(f, count)
+                self.covered[crypto_id] = meta['from']
+            elif os.path.exists(ts_path):
+                # Файлы старого формата перезаписываются при первой докачке
+                os.remove(ts_path)
+                if os.path.exists(px_path):
+                    os.remove(px_path)
+            self.series[crypto_id] = (timestamps, prices)
+        return self.series[crypto_id]
+
+    # Участки [from, to] в секундах, которых не хватает для окна. Начало
+    # ряда докачивается от уже сохранённого назад, хвост - вперёд, чтобы
+    # каждый кусок ложился на свой край ряда
+    def missing(self, crypto_id, start, end):
+        timestamps, _ = self.load(crypto_id)
+        if not timestamps:
+            return self._chunks(start, end, backwards=True)
+        gaps = []
+        if start < self.covered[crypto_id]:
+            gaps.extend(self._chunks(start, self.covered[crypto_id], backwards=True))
+        if end - self.checked.get(crypto_id, 0) > self.refresh:
+            gaps.extend(self._chunks(timestamps[-1] / 1000, end))
+        return gaps
+
+    def _chunks(self, start, end, backwards=False):
+        bounds = []
+        while start < end:
+            bounds.append((start, min(end, start + self.chunk)))
+            start += self.chunk
+        return bounds[::-1] if backwards else bounds
+
+    # Добавление точек [[ms, price], ...], полученных за участок [start, end]
+    def add(self, crypto_id, points, start, end):
+        timestamps, prices = self.load(crypto_id)
+        os.makedirs(self.path, exist_ok=True)
+        ts_path, px_path = self._file(crypto_id, 'ts'), self._file(crypto_id, 'px')
+
+        if timestamps and start < self.covered[crypto_id]:
+            # Начало ряда: точки раньше уже сохранённых, файлы перезаписываются
+            first = timestamps[0]
+            head = [point for point in points if point[0] < first]
+            timestamps[0:0] = array('d', [point[0] for point in head])
+            prices[0:0] = array('d', [point[1] for point in head])
+            with open(ts_path, 'wb') as f:
+                timestamps.tofile(f)
+            with open(px_path, 'wb') as f:
+                prices.tofile(f)
+        else:
+            # Хвост ряда: новые точки дописываются в конец файлов
+            last = timestamps[-1] if timestamps else float('-inf')
+            tail = [point for point in points if point[0] > last]
+            new_timestamps = array('d', [point[0] for point in tail])
+            new_prices = array('d', [point[1] for point in tail])
+            with open(ts_path, 'ab') as f:
+                new_timestamps.tofile(f)
+            with open(px_path, 'ab') as f:
+                new_prices.tofile(f)
+            timestamps.extend(new_timestamps)
+            prices.extend(new_prices)
+            self.checked[crypto_id] = end
+
+        self.covered[crypto_id] = min(start, self.covered.get(crypto_id, start))
+        with open(self._file(crypto_id, 'json'), 'w') as f:
+            json.dump({'from': self.covered[crypto_id], 'format': self.FORMAT}, f)
+
+    # Текущая цена и цена в начале окна, начинающегося в start (сек)
+    def window(self, crypto_id, start):
+        timestamps, prices = self.load(crypto_id)
+        if not timestamps:
+            raise ValueError(f"No price data for {crypto_id}")
+        index = min(bisect_left(timestamps, start * 1000), len(timestamps) - 1)
+        return int(prices[-1]), int(prices[index])
+
+# Результат пакетной аналитики цен в виде столбцов: i-й элемент каждого
+# массива (i-я строка rolling_returns) относится к crypto_ids[i]
+class PriceAnalytics(NamedTuple):
+    crypto_ids: tuple
+    timestamps: np.ndarray       # общая сетка времени, мс
+    pct_change: np.ndarray       # изменение цены за период, %
+    volatility: np.ndarray       # дневная волатильность лог-доходностей, %
+    max_drawdown: np.ndarray     # максимальная просадка, % (<= 0)
+    rolling_returns: np.ndarray  # доходность за rolling_steps шагов сетки, %
+
+    # Монеты с наибольшим по модулю изменением цены
+    def top_movers(self, count=5):
+        order = np.argsort(-np.abs(np.nan_to_num(self.pct_change)))[:count]
+        return [(self.crypto_ids[i], float(self.pct_change[i])) for i in order]
+
+# Аналитика по выровненным на общую сетку рядам цен, одним проходом NumPy
+def price_analytics(crypto_ids, series, start, end, step=PRICE_GRID_STEP, rolling_steps=24):
+    grid = np.arange(start * 1000, end * 1000 + 1, step * 1000)
+    if len(grid) < 2:
+        grid = np.array([start * 1000, end * 1000])
+    matrix = np.full((len(crypto_ids), len(grid)), np.nan)
+    for row, (timestamps, prices) in enumerate(series):
+        if len(timestamps):
+            matrix[row] = np.interp(grid, np.frombuffer(timestamps), np.frombuffer(prices))
+
+    pct_change = (matrix[:, -1] / matrix[:, 0] - 1) * 100
+    log_returns = np.diff(np.log(matrix), axis=1)
+    volatility = log_returns.std(axis=1) * np.sqrt(86400 / step) * 100
+    max_drawdown = (matrix / np.maximum.accumulate(matrix, axis=1) - 1).min(axis=1) * 100
+    rolling_steps = max(1, min(rolling_steps, len(grid) - 1))
+    rolling_returns = (matrix[:, rolling_steps:] / matrix[:, :-rolling_steps] - 1) * 100
+
+    return PriceAnalytics(tuple(crypto_ids), grid, pct_change, volatility, max_drawdown, rolling_returns)
+
+# Нормализация заголовка: без источника в конце (" - Reuters"),
+# пунктуации, регистра и лишних пробелов
+def normalize_headline(title):
+    title = re.sub(r'\s+[-|\u2013\u2014]\s+[^-|\u2013\u2014]+$', '', title or '')
+    return ' '.join(re.findall(r'\w+', title.lower()))
+
+# Оценка числа токенов (tiktoken, если установлен, иначе ~4 символа на токен)
+def count_tokens(text):
+    if tiktoken is not None:
+        return len(tiktoken.encoding_for_model("gpt-4").encode(text))
+    return len(text) // 4 + 1
+
+# Ключ кэша сантиментов
+def headline_key(title):
+    return hashlib.sha1(normalize_headline(title).encode('utf-8')).hexdigest()
+
+# Схлопывание точных и почти точных дублей заголовков (по доле общих слов).
+# Возвращает список уникальных заголовков в исходном порядке.
+def dedup_headlines(headlines, threshold=HEADLINE_DUPLICATE_THRESHOLD):
+    unique = []
+    seen = set()
+    unique_words = []
+    for title in headlines:
+        normalized = normalize_headline(title)
+        if normalized in seen:
+            continue
+        seen.add(normalized)
+        words = set(normalized.split())
+        if any(words and other and len(words & other) / len(words | other) >= threshold for other in unique_words):
+            continue
+        unique.append(title)
+        unique_words.append(words)
+    return unique
+
+# Кэш сантиментов с TTL и вытеснением самых давно использованных записей
+class SentimentCache:
+    def __init__(self, ttl=SENTIMENT_CACHE_TTL, max_size=SENTIMENT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = OrderedDict()  # key -> (expires_at, sentiment)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return item[1]
+
+    def set(self, key, sentiment):
+        self.items[key] = (time.monotonic() + self.ttl, sentiment)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+# Локальный разбор типовых сообщений пользователя, без обращения к GPT-4
+COIN_PATTERN = re.compile(r'\b(bitcoin|btc)\b|биткоин|биткойн|биток', re.IGNORECASE)
+# Слово об изменении считается, только если рядом (до PRICE_CONTEXT_WORDS
+# слов) говорится о цене: "I lost my bitcoin wallet" - не вопрос о курсе
+PRICE_WORDS = r'\b(price|cost|worth|value|rate|цен|курс|стои)'
+CHANGE_WORDS = (
+    r'\b(chang|mov|ris|rose|fell|fall|grow|grew|drop|increas|decreas|gain|los|go(ne)? (up|down)|went (up|down)'
+    r'|измен|вырос|рост|упал|паден|подорож|подешев|снизил|повысил)'
+)
+PRICE_CONTEXT_WORDS = 4
+CHANGE_PATTERN = re.compile(
+    rf'{PRICE_WORDS}\w*(\W+\w+){{0,{PRICE_CONTEXT_WORDS}}}?\W+{CHANGE_WORDS}'
+    rf'|{CHANGE_WORDS}\w*(\W+\w+){{0,{PRICE_CONTEXT_WORDS}}}?\W+{PRICE_WORDS}',
+    re.IGNORECASE
+)
+FUTURE_PATTERN = re.compile(
+    r'\b(will|next|forecast|predict|tomorrow|going to)\b|будет|следующ|прогноз|завтра|предскаж',
+    re.IGNORECASE
+)
+# Вопросы о боте узнаются только целиком, чтобы "can you help me with my
+# homework" или "what are you doing" не считались просьбой о справке
+HELP_PATTERN = re.compile(
+    r'^\W*/?(help|помощь|помоги|справка)\W*$'
+    r'|\b(what can you do|what (can|could) you help( me)? with|how (can|could) you help( me)?|what do you do'
+    r'|how do you work|who are you|what are you)\W*$'
+    r'|\byour (features|functions|capabilities|commands)\b'
+    r'|(что (ты )?(умеешь|можешь)|чем (ты )?(можешь )?помочь|кто ты( такой)?|как (ты )?работаешь|что ты такое)\W*$'
+    r'|твои (функции|возможности|команды)',
+    re.IGNORECASE
+)
+
+NUMBER_WORDS = {
+    'a': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'один': 1, 'одну': 1, 'одного': 1, 'два': 2, 'две': 2, 'двух': 2, 'три': 3, 'трех': 3, 'трёх': 3, 'четыре': 4,
+    'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10,
+}
+
+# Единицы периода и их длина в днях
+PERIOD_UNITS = [
+    (re.compile(r'^(days?|d)$|^(дн|день|дня|сут)'), 1),
+    (re.compile(r'^(weeks?|w)$|^недел'), 7),
+    (re.compile(r'^months?$|^месяц'), 30),
+    (re.compile(r'^(years?|y)$|^(год|лет)'), 365),
+]
+# Число не должно быть дробной частью: из "1.5 weeks" не получается 5 недель
+AMOUNT_PATTERN = re.compile(r'(?=(?<![\d.,/])\b(\d+|[a-zа-яё]+)\s+([a-zа-яё]+))', re.IGNORECASE)
+# Период без числа: "last week", "за месяц", "today"...
+SINGLE_PERIOD_PATTERNS = [
+    (re.compile(r'\b(today|yesterday|24 hours)\b|сегодня|вчера|сутки|24 час', re.IGNORECASE), 1),
+    (re.compile(r'\b(last|past|this) week\b|(прошл|последн|эт)\w* недел|за недел', re.IGNORECASE), 7),
+    (re.compile(r'\b(last|past|this) month\b|(прошл|последн|эт)\w* месяц|за месяц', re.IGNORECASE), 30),
+    (re.compile(r'\b(last|past|this) year\b|(прошл|последн|эт)\w* год|за год', re.IGNORECASE), 365),
+]
+
+# Названия месяцев целыми словами: полные, в родительном падеже и сокращения
+MONTHS = {
+    'january': 1, 'jan': 1, 'february': 2, 'feb': 2, 'march': 3, 'mar': 3, 'april': 4, 'apr': 4, 'may': 5,
+    'june': 6, 'jun': 6, 'july': 7, 'jul': 7, 'august': 8, 'aug': 8, 'september': 9, 'sept': 9, 'sep': 9,
+    'october': 10, 'oct': 10, 'november': 11, 'nov': 11, 'december': 12, 'dec': 12,
+    'январь': 1, 'января': 1, 'янв': 1, 'февраль': 2, 'февраля': 2, 'фев': 2, 'март': 3, 'марта': 3, 'мар': 3,
+    'апрель': 4, 'апреля': 4, 'апр': 4, 'май': 5, 'мая': 5, 'июнь': 6, 'июня': 6, 'июн': 6, 'июль': 7, 'июля': 7, 'июл': 7,
+    'август': 8, 'августа': 8, 'авг': 8, 'сентябрь': 9, 'сентября': 9, 'сен': 9, 'сент': 9,
+    'октябрь': 10, 'октября': 10, 'окт': 10, 'ноябрь': 11, 'ноября': 11, 'ноя': 11, 'декабрь': 12, 'декабря': 12, 'дек': 12,
+}
+ISO_DATE_PATTERN = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+NUMERIC_DATE_PATTERN = re.compile(r'\b(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?\b')
+# После числа вида 1.5 или 3/4 - проценты, единица периода или "of": это не дата
+NUMBER_SUFFIX_PATTERN = re.compile(
+    r'\s*(%|percent|процент|of\b|times\b|x\b|раз|(hours?|days?|weeks?|months?|years?)\b|час|дн|день|дня|сут|недел|месяц|год|лет)',
+    re.IGNORECASE
+)
+DAY_MONTH_PATTERN = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+([a-zа-яё]{3,})\b\.?(?:\s+(\d{4}))?', re.IGNORECASE)
+MONTH_DAY_PATTERN = re.compile(r'\b([a-z]{3,})\b\.?\s+(\d{1,2})(?:st|nd|rd|th)?\b,?(?:\s+(\d{4}))?', re.IGNORECASE)
+
+def _month_number(word):
+    return MONTHS.get(word.lower())
+
+# Дата из сообщения; без года берётся последняя прошедшая такая дата
+def _parse_date(day, month, year, today):
+    try:
+        if year:
+            year = int(year)
+            if year < 100:
+                year += 2000
+            return date(year, month, int(day))
+        value = date(today.year, month, int(day))
+        return value if value <= today else date(today.year - 1, month, int(day))
+    except ValueError:
+        return None
+
+def _message_dates(message, today):
+    dates = []
+    for year, month, day in ISO_DATE_PATTERN.findall(message):
+        dates.append(_parse_date(day, int(month), year, today))
+    without_iso = ISO_DATE_PATTERN.sub(' ', message)
+    for match in NUMERIC_DATE_PATTERN.finditer(without_iso):
+        day, month, year = match.groups()
+        # Без года "1.5" и "3/4" - скорее дробь, чем 1 мая или 3 апреля
+        if not year and (len(month) == 1 or NUMBER_SUFFIX_PATTERN.match(without_iso, match.end())):
+            continue
+        dates.append(_parse_date(day, int(month), year, today))
+    for day, month, year in DAY_MONTH_PATTERN.findall(without_iso):
+        if _month_number(month):
+            dates.append(_parse_date(day, _month_number(month), year, today))
+    for month, day, year in MONTH_DAY_PATTERN.findall(without_iso):
+        if _month_number(month):
+            dates.append(_parse_date(day, _month_number(month), year, today))
+    return dates
+
+def _message_periods(message):
+    periods = []
+    for amount, unit in AMOUNT_PATTERN.findall(message):
+        amount = int(amount) if amount.isdigit() else NUMBER_WORDS.get(amount.lower())
+        if amount is None:
+            continue
+        for pattern, days in PERIOD_UNITS:
+            if pattern.search(unit.lower()):
+                periods.append(amount * days)
+                break
+    if not periods:
+        for pattern, days in SINGLE_PERIOD_PATTERNS:
+            if pattern.search(message):
+                periods.append(days)
+    return periods
+
+# Быстрая классификация сообщения: '-1' для вопросов о боте, число дней для
+# вопросов об изменении цены биткоина за прошедший период, None если
+# локальных правил недостаточно и решать должен GPT-4
+def classify_user_message(message, today=None):
+    if not message:
+        return None
+    today = today or datetime.now().date()
+
+    if COIN_PATTERN.search(message):
+        if FUTURE_PATTERN.search(message) or not CHANGE_PATTERN.search(message):
+            return None
+        dates = [value for value in _message_dates(message, today) if value is not None]
+        periods = _message_periods(message)
+        # Дата и период вместе - неоднозначно, решает GPT-4
+        if dates and periods:
+            return None
+        if dates:
+            candidates = {(today - value).days for value in dates}
+        else:
+            candidates = set(periods)
+        # Уверенный ответ только при одном однозначном периоде в прошлом
+        if len(candidates) == 1:
+            days = candidates.pop()
+            if days > 0:
+                return str(days)
+        return None
+
+    if HELP_PATTERN.search(message):
+        return '-1'
+    return None
+
+# Кэш отчётов по ключу (монета, дни, временная корзина) с объединением
+# одновременных одинаковых запросов: все ждут одно вычисление. Вычисление
+# возвращает (отчёт, можно ли его кэшировать): неполный отчёт получают
+# ожидающие, но следующий запрос посчитает его заново
+class ReportCache:
+    def __init__(self, ttl=REPORT_CACHE_TTL, bucket=REPORT_CACHE_BUCKET):
+        self.ttl = ttl
+        self.bucket = bucket
+        self.items = {}      # key -> (expires_at, report)
+        self.in_flight = {}  # key -> asyncio.Task
+
+    def key(self, crypto_id, days):
+        return (crypto_id, days, int(time.time() // self.bucket))
+
+    # Готовый отчёт или None
+    def peek(self, key):
+        item = self.items.get(key)
+        if item is not None and item[0] >= time.monotonic():
+            return item[1]
+        return None
+
+    async def get_or_create(self, key, factory):
+        report = self.peek(key)
+        if report is not None:
+            return report
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # Отмена одного ожидающего не должна отменять общее вычисление
+        report, _ = await asyncio.shield(task)
+        return report
+
+    def _finish(self, key, task):
+        self.in_flight.pop(key, None)
+        now = time.monotonic()
+        # Ошибки и неполные отчёты не кэшируются, следующий запрос повторит вычисление
+        if not task.cancelled() and task.exception() is None:
+            report, cacheable = task.result()
+            if cacheable:
+                self.items[key] = (now + self.ttl, report)
+        for stale in [stale for stale, item in self.items.items() if item[0] < now]:
+            del self.items[stale]
+
+# Правка сообщения Telegram не чаще одного раза в interval секунд;
+# промежуточные версии текста, пришедшие раньше, пропускаются
+class ThrottledEditor:
+    def __init__(self, message, text, interval=MESSAGE_EDIT_INTERVAL):
+        self.message = message
+        self.text = text
+        self.sent_text = text
+        self.interval = interval
+        self.edited_at = time.monotonic()
+
+    async def update(self, text):
+        self.text = text
+        if time.monotonic() - self.edited_at >= self.interval:
+            await self._edit()
+
+    # Отправка последней версии текста
+    async def flush(self):
+        if self.text != self.sent_text:
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - self.edited_at)))
+            await self._edit()
+
+    async def _edit(self):
+        if self.text == self.sent_text:
+            return
+        try:
+            await self.message.edit_text(self.text)
+        except TelegramBadRequest as e:
+            logging.warning(f"Could not edit message: {e}")
+        self.sent_text = self.text
+        self.edited_at = time.monotonic()
+
+# Ведро токенов, пополняемое со скоростью per_minute в минуту; вмещает
+# burst_seconds секунд пополнения. Запрос больше ёмкости ждёт полного
+# ведра и списывается целиком, уводя ведро в минус, поэтому крупные
+# запросы тоже идут со скоростью квоты
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=5):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self.wait_time(0, now)
+        self.tokens -= amount
+
+# Регулятор запросов к GPT-4: запросы ждут места в ведрах RPM и TPM в
+# порядке приоритета, внутри приоритета - по пользователям по кругу, чтобы
+# один активный пользователь не занимал всю квоту. Ответ 429 с Retry-After
+# приостанавливает все запросы, а не только повторённый
+class RateLimiter:
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, headroom=OPENAI_RATE_HEADROOM):
+        self.requests = TokenBucket(rpm * headroom)
+        self.tokens = TokenBucket(tpm * headroom)
+        self.paused_until = 0.0
+        # По приоритету: пользователь -> очередь (tokens, future)
+        self.queues = [OrderedDict(), OrderedDict()]
+        self.dispatcher = None
+
+    def _wait_time(self, tokens, now):
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), 0.0)
+
+    def _take(self, tokens, now):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+    async def acquire(self, tokens, priority=INTERACTIVE, user_id=None):
+        now = time.monotonic()
+        if not any(self.queues) and self._wait_time(tokens, now) == 0:
+            self._take(tokens, now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(str(user_id), deque()).append((tokens, future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    # Первый пользователь самого приоритетного непустого уровня; отменённые вызовы выбрасываются
+    def _next(self):
+        for users in self.queues:
+            while users:
+                user, waiters = next(iter(users.items()))
+                if not waiters[0][1].done():
+                    return users, user, waiters
+                waiters.popleft()
+                if not waiters:
+                    del users[user]
+        return None
+
+    async def _dispatch(self):
+        while (head := self._next()) is not None:
+            users, user, waiters = head
+            tokens, future = waiters[0]
+            wait = self._wait_time(tokens, time.monotonic())
+            if wait > 0:
+                # За время ожидания может появиться более приоритетный запрос
+                await asyncio.sleep(min(wait, 0.5))
+                continue
+            # Пользователь уходит в конец круга
+            waiters.popleft()
+            del users[user]
+            if waiters:
+                users[user] = waiters
+            self._take(tokens, time.monotonic())
+            future.set_result(None)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# Пауза из заголовков ответа 429, секунд
+def retry_after_seconds(error, default=1.0):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return default
+
+# Сбои, после которых запрос имеет смысл повторить
+def is_retryable(error):
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError, openai.error.APIConnectionError,
+                          openai.error.Timeout, openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status in (408, 429)
+    if isinstance(error, openai.error.APIError):
+        return (error.http_status or 0) >= 500
+    return False
+
+# Обёртка вызовов одного внешнего метода: вызов дольше p95 дублируется
+# (берётся первый успешный ответ), повторяемые сбои повторяются с
+# экспоненциальной задержкой со случайным разбросом в пределах общего срока
+class Endpoint:
+    def __init__(self, name, deadline=REQUEST_DEADLINE):
+        self.name = name
+        self.deadline = deadline
+        self.latency = deque(maxlen=HEDGE_WINDOW)
+
+    def hedge_delay(self):
+        if len(self.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latency)
+        return ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+
+    async def call(self, request, hedge=True):
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + self.deadline
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                return await asyncio.wait_for(self._hedged(request) if hedge else self._timed(request), expires - loop.time())
+            except Exception as e:
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                if attempt == RETRY_ATTEMPTS or not is_retryable(e) or loop.time() + delay >= expires:
+                    raise
+                logging.warning(f"{self.name}: повтор {attempt} через {delay:.2f} с после ошибки: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _timed(self, request):
+        started = time.monotonic()
+        result = await request()
+        self.latency.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, request):
+        pending = {asyncio.ensure_future(self._timed(request))}
+        delay = self.hedge_delay()
+        try:
+            if delay is not None and not (await asyncio.wait(pending, timeout=delay))[0]:
+                pending.add(asyncio.ensure_future(self._timed(request)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
 class CryptoAnalyzer:
-    def __init__(self, openai_key, news_api_key):
+    def __init__(self, openai_key, news_api_key, price_store=None, sentiment_cache=None):
         # Инициализация ключей API
         self.openai_key = openai_key
         self.news_api_key = news_api_key
         openai.api_key = openai_key
+        self.price_store = price_store or PriceStore()
+        self.sentiment_cache = sentiment_cache or SentimentCache()
 
     # Получение цен криптовалюты
     def get_crypto_prices(self, crypto_id='bitcoin', days=2):
-        url = f'https://api.coingecko.com/api/v3/coins/{crypto_id}/market_chart'
-        params = {
+        end = time.time()
+        start = end - days * 86400
+
+        # Докачиваются только участки, которых нет в локальном хранилище
+        for gap_start, gap_end in self.price_store.missing(crypto_id, start, end):
+            url = f'{COINGECKO_API_URL}/coins/{crypto_id}/market_chart/range'
+            response = requests.get(url, params=self._price_range_params(gap_start, gap_end))
+            self.price_store.add(crypto_id, response.json()['prices'], gap_start, gap_end)
+
+        # Текущая цена и цена в начале периода
+        return self.price_store.window(crypto_id, start)
+
+    # Параметры запроса market_chart/range
+    def _price_range_params(self, start, end):
+        return {
             'vs_currency': 'usd',
-            'days': days
+            'from': int(start),
+            'to': int(end) + 1
         }
-        response = requests.get(url, params=params)
-        data = response.json()
-    
-        # Создание DataFrame из данных цен
-        prices = pd.DataFrame(data['prices'], columns=['timestamp', 'price'])
-    
-        # Получение первого и последнего значения из второго столбца
-        second_column = prices.iloc[:, 1]  # Второй столбец (индекс 1)
-    
-        present_value = int(second_column.iloc[-1])  # Текущая цена
-        past_value = int(second_column.iloc[0])  # Цена в начале периода
-    
-        return present_value, past_value
 
     # Получение новостей
     def get_crypto_news(self, query='bitcoin', days=7):
+        url = f'{NEWS_API_URL}/everything'
+        response = requests.get(url, params=self._news_params(query, days))
+        data = response.json()
+    
+        # Получение списка статей
+        articles = data['articles']
+        return articles
+
+    # Параметры запроса к NewsAPI
+    def _news_params(self, query, days):
         api_key = self.news_api_key  # Используем ключ из переменных окружения
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
-        url = 'https://newsapi.org/v2/everything'
-        params = {
+        return {
            'q': query,
             'from': start_date.isoformat(),
            'to': end_date.isoformat(),
@@ -66,12 +796,6 @@ class CryptoAnalyzer:
            'language': 'en',
            'apiKey': api_key
         }
-        response = requests.get(url, params=params)
-        data = response.json()
-    
-        # Получение списка статей
-        articles = data['articles']
-        return articles
 
     # Анализ новостей с помощью GPT-4
     
@@ -79,52 +803,115 @@ class CryptoAnalyzer:
         # Create a list of headlines from news articles
         headlines = [article['title'] for article in news_articles]
 
-        # Construct the prompt for GPT-4
+        # Only headlines the cache has not seen are sent to GPT-4
+        headlines, keys, sentiments = self._cached_sentiments(headlines)
+        pending = [i for i, sentiment in enumerate(sentiments) if sentiment is None]
+
+        for chunk in self._sentiment_chunks(headlines, pending):
+            try:
+                # Call OpenAI API to analyze sentiments
+                response = openai.ChatCompletion.create(**self._news_request([headlines[i] for i in chunk]))
+                self._store_sentiments(keys, sentiments, self._parse_news_analysis(response, chunk))
+
+            except openai.error.PermissionError as e:
+                print(f"OpenAI PermissionError: {e}")
+            except Exception as e:
+                print(f"Error analyzing news with GPT-4: {e}")
+
+        return self._sentiment_results(headlines, sentiments)
+
+    # Deduplicated headlines with their cache keys and cached sentiments (None if unknown)
+    def _cached_sentiments(self, headlines):
+        headlines = dedup_headlines(headlines)
+        keys = [headline_key(headline) for headline in headlines]
+        sentiments = [self.sentiment_cache.get(key) for key in keys]
+        return headlines, keys, sentiments
+
+    # Split pending headline indices into chunks that fit the token budget
+    def _sentiment_chunks(self, headlines, pending):
+        chunks = []
+        chunk = []
+        used = 0
+        for i in pending:
+            tokens = count_tokens(str(headlines[i])) + 4
+            if chunk and used + tokens > SENTIMENT_CHUNK_TOKENS:
+                chunks.append(chunk)
+                chunk = []
+                used = 0
+            chunk.append(i)
+            used += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    # Put freshly scored sentiments ({headline index: sentiment}) in place and cache them
+    def _store_sentiments(self, keys, sentiments, scored):
+        for i, sentiment in scored.items():
+            sentiments[i] = sentiment
+            self.sentiment_cache.set(keys[i], sentiment)
+
+    def _sentiment_results(self, headlines, sentiments):
+        return [
+            {'title': headline, 'analysis': sentiment}
+            for headline, sentiment in zip(headlines, sentiments)
+            if sentiment is not None
+        ]
+
+    # Construct the GPT-4 request for headline sentiment
+    def _news_request(self, headlines):
         prompt = "Analyze the sentiment of the following news headlines and provide the sentiment for each Positive (1), Neutral(0), Negative(-1): \n\n"
         for i, headline in enumerate(headlines, 1):
             prompt += f"{i}. \"{headline}\"\n"
 
         # prompt += "\nIn your answer, return only the number corresponding to the sentiment of the news for each headline, in the same order. That is, in the form of a table like the name of the news in the column is only sentiment number."
         
-        prompt += "\nIn your answer, return ONLY a column of NUMBERS (just numbers) corresponding to the sentiment"
+        prompt += f"\nReport the sentiment of every headline by its number with the {SENTIMENT_FUNCTION['name']} function."
 
-        results = []
-
-        try:
-            # Call OpenAI API to analyze sentiments
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
+        return dict(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": prompt}
+            ],
+            functions=[SENTIMENT_FUNCTION],
+            function_call={"name": SENTIMENT_FUNCTION['name']},
+            # Around 20 tokens per {"index": .., "sentiment": ..} item
+            max_tokens=20 * len(headlines) + 50,
+            temperature=0
+        )
 
-            # Parse sentiment analysis results
-            sentiment_analysis = response['choices'][0]['message']['content'].strip().split("\n")
+    # Parse sentiment analysis results into {headline index: sentiment} for the chunk
+    def _parse_news_analysis(self, response, chunk):
+        arguments = json.loads(response['choices'][0]['message']['function_call']['arguments'])
+        scored = {}
+        for item in arguments.get('sentiments', []):
+            number = item.get('index')
+            sentiment = item.get('sentiment')
+            # Numbers outside the chunk or unknown sentiments are ignored, not misaligned
+            if isinstance(number, int) and 1 <= number <= len(chunk) and sentiment in (-1, 0, 1):
+                scored[chunk[number - 1]] = str(sentiment)
+        return scored
 
-            # Ensure lengths match before iterating
-            # if len(headlines) != len(sentiment_analysis):
-            #     raise ValueError("Number of headlines does not match number of sentiment analyses")
+    # Анализ сообщений пользователя
+    def analyze_user_message(self, message):
+        # Простые формулировки разбираются локально
+        result = classify_user_message(message)
+        if result is not None:
+            return result
 
-            # Create results dictionary
-            results = []
-            for i, sentiment in enumerate(sentiment_analysis):
-                results.append({
-                    'title': headlines[i],
-                    'analysis': sentiment
-                })
+        try:
+            response = openai.ChatCompletion.create(**self._user_message_request(message))
 
+            # Обработка результата анализа сообщения
+            result = response['choices'][0]['message']['content'].strip()
+    
+            return result
+        except ValueError:
+            return -4
         except openai.error.PermissionError as e:
             print(f"OpenAI PermissionError: {e}")
-        except Exception as e:
-            print(f"Error analyzing news with GPT-4: {e}")
 
-        return results
-
-    # Анализ сообщений пользователя
-    def analyze_user_message(self, message):
+    # Запрос к GPT-4 для классификации сообщения пользователя
+    def _user_message_request(self, message):
         
         # Получение текущей даты
         current_date = datetime.now().date()
@@ -136,55 +923,280 @@ class CryptoAnalyzer:
             In all other cases, return -2.
             Message: \"{message}\"
             In your answer, return only the number corresponding to the sentiment of the message."""
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": prompt}
-                ],
-                max_tokens=10,
-                temperature=0.7
-            )
-
-            # Обработка результата анализа сообщения
-            result = response['choices'][0]['message']['content'].strip()
-    
-            return result
-        except ValueError:
-            return -4
-        except openai.error.PermissionError as e:
-            print(f"OpenAI PermissionError: {e}")
+        return dict(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": prompt}
+            ],
+            max_tokens=10,
+            temperature=0.7
+        )
 
     # Формирование окончательного сообщения
-    def formation_final_message(self, days):
+    def formation_final_message(self, days, crypto_id='bitcoin'):
     
         # Получение списка новостей
-        news = self.get_crypto_news(query='bitcoin', days=days)
+        news = self.get_crypto_news(query=crypto_id, days=days)
         
         # Получение разбитого по сантиментам списка нвостей
         analyzed_news = self.analyze_news_with_gpt4(news)
         print(analyzed_news)
         
         # Почучение информации о изменении цены
-        present_value, past_value = self.get_crypto_prices(crypto_id='bitcoin', days=days)
+        present_value, past_value = self.get_crypto_prices(crypto_id=crypto_id, days=days)
 
-        # Определение направления изменения цены
-        direction = present_value > past_value
-        direction_word = 'increased' if direction else 'decreased'
+        return self._compose_final_message(days, analyzed_news, present_value, past_value, crypto_id)
 
-        check = '1' if direction else '-1'
+    # Текст ответа по изменению цены и новостям
+    def _compose_final_message(self, days, analyzed_news, present_value, past_value, crypto_id='bitcoin'):
+        check = '1' if present_value > past_value else '-1'
         
         # Формирование текста новостей на основе анализа сентимента
         news_text = ""
         for analysis in analyzed_news:
             if analysis['analysis'] == check:
                 news_text += f"- {analysis['title']}\n"
+
+        return f"{self._price_change_line(days, present_value, past_value, crypto_id)} \n\nThis is due to the following news events over the given period:\n{news_text}"
+
+    # Строка об изменении цены
+    def _price_change_line(self, days, present_value, past_value, crypto_id='bitcoin'):
+        # Определение направления изменения цены
+        direction = present_value > past_value
+        direction_word = 'increased' if direction else 'decreased'
         percentage_change = round(abs(((present_value - past_value) / past_value) * 100), 2)
 
-        return f"Bitcoin price for a period of {days} days {direction_word} by {percentage_change}%. \n\nThis is due to the following news events over the given period:\n{news_text}"
+        return f"{crypto_id.capitalize()} price for a period of {days} days {direction_word} by {percentage_change}%."
+
+# Асинхронный вариант анализатора: все внешние вызовы идут через один
+# общий пул keep-alive соединений и не блокируют цикл событий бота
+class AsyncCryptoAnalyzer(CryptoAnalyzer):
+    def __init__(self, openai_key, news_api_key, price_store=None, sentiment_cache=None, report_cache=None, rate_limiter=None):
+        super().__init__(openai_key, news_api_key, price_store, sentiment_cache)
+        self.report_cache = report_cache or ReportCache()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.market_chart_endpoint = Endpoint('coingecko.market_chart')
+        self.news_endpoint = Endpoint('newsapi.everything')
+        self.gpt_endpoint = Endpoint('openai.chat_completions', deadline=REQUEST_DEADLINE * 2)
+        self.session = None
+        # Блокировки докачки цен, чтобы параллельные запросы не качали одно и то же
+        self.price_locks = {}
+        self.sentiment_semaphore = asyncio.Semaphore(SENTIMENT_CONCURRENCY)
+
+    # Создание общей HTTP-сессии (вызывается при старте бота)
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+            )
+        return self.session
+
+    # Закрытие HTTP-сессии (вызывается при остановке бота)
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def _get_json(self, url, params, endpoint):
+        async def fetch():
+            session = await self.start()
+            async with session.get(url, params=params, raise_for_status=True) as response:
+                return await response.json(content_type=None)
+        return await endpoint.call(fetch)
+
+    async def _chat_completion(self, request, priority=INTERACTIVE, user_id=None):
+        # OpenAI SDK берёт сессию из contextvar, поэтому выставляем её
+        # в контексте текущей задачи перед каждым вызовом
+        openai.aiosession.set(await self.start())
+        tokens = sum(count_tokens(message['content'] or '') for message in request['messages']) + request.get('max_tokens', 256)
+
+        for attempt in range(OPENAI_RATE_RETRIES + 1):
+            await self.rate_limiter.acquire(tokens, priority, user_id)
+            try:
+                # Повторы идут внутри полученного слота, поэтому срок запроса не
+                # включает ожидание квоты. Запросы к GPT-4 дороги, поэтому без дублей.
+                return await self.gpt_endpoint.call(lambda: openai.ChatCompletion.acreate(**request), hedge=False)
+            except openai.error.RateLimitError as e:
+                if attempt == OPENAI_RATE_RETRIES:
+                    raise
+                self.rate_limiter.pause(retry_after_seconds(e))
+
+    # Получение цен криптовалюты
+    async def get_crypto_prices(self, crypto_id='bitcoin', days=2):
+        end = time.time()
+        start = end - days * 86400
+        await self._refresh_prices(crypto_id, start, end)
+        return self.price_store.window(crypto_id, start)
+
+    # Пакетная аналитика цен по нескольким криптовалютам
+    async def get_crypto_prices_batch(self, crypto_ids, days=7, rolling_steps=24):
+        end = time.time()
+        start = end - days * 86400
+        await asyncio.gather(*(self._refresh_prices(crypto_id, start, end) for crypto_id in crypto_ids))
+        series = [self.price_store.load(crypto_id) for crypto_id in crypto_ids]
+        return price_analytics(crypto_ids, series, start, end, rolling_steps=rolling_steps)
+
+    # Докачка недостающих участков ряда цен
+    async def _refresh_prices(self, crypto_id, start, end):
+        lock = self.price_locks.setdefault(crypto_id, asyncio.Lock())
+        async with lock:
+            for gap_start, gap_end in self.price_store.missing(crypto_id, start, end):
+                url = f'{COINGECKO_API_URL}/coins/{crypto_id}/market_chart/range'
+                data = await self._get_json(url, self._price_range_params(gap_start, gap_end), self.market_chart_endpoint)
+                self.price_store.add(crypto_id, data['prices'], gap_start, gap_end)
+
+    # Получение новостей
+    async def get_crypto_news(self, query='bitcoin', days=7):
+        url = f'{NEWS_API_URL}/everything'
+        data = await self._get_json(url, self._news_params(query, days), self.news_endpoint)
+        return data['articles']
+
+    # Анализ новостей с помощью GPT-4
+    async def analyze_news_with_gpt4(self, news_articles):
+        results, _ = await self._analyze_news(news_articles)
+        return results
+
+    # Итоговые сантименты и число чанков, которые не удалось оценить
+    async def _analyze_news(self, news_articles):
+        results, failed = [], 0
+        async for results, failed in self.iter_news_sentiment(news_articles):
+            pass
+        return results, failed
+
+    # Сантименты по мере готовности: сначала то, что есть в кэше, затем
+    # объединённый результат после каждого оценённого чанка. Вместе с
+    # результатом отдаётся число чанков, оценка которых не удалась
+    async def iter_news_sentiment(self, news_articles):
+        headlines = [article['title'] for article in news_articles]
+
+        headlines, keys, sentiments = self._cached_sentiments(headlines)
+        pending = [i for i, sentiment in enumerate(sentiments) if sentiment is None]
+        failed = 0
+        yield self._sentiment_results(headlines, sentiments), failed
+
+        # Чанки оцениваются параллельно, результаты сливаются по номерам заголовков
+        chunks = self._sentiment_chunks(headlines, pending)
+        tasks = [asyncio.ensure_future(self._score_chunk(headlines, chunk)) for chunk in chunks]
+        try:
+            for next_scored in asyncio.as_completed(tasks):
+                scored = await next_scored
+                if scored is None:
+                    failed += 1
+                    continue
+                self._store_sentiments(keys, sentiments, scored)
+                yield self._sentiment_results(headlines, sentiments), failed
+            if failed:
+                yield self._sentiment_results(headlines, sentiments), failed
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # Оценка одного чанка заголовков с ограничением числа одновременных запросов;
+    # None, если оценить не удалось
+    async def _score_chunk(self, headlines, chunk):
+        async with self.sentiment_semaphore:
+            try:
+                response = await self._chat_completion(self._news_request([headlines[i] for i in chunk]), BACKGROUND)
+                return self._parse_news_analysis(response, chunk)
+
+            except openai.error.PermissionError as e:
+                print(f"OpenAI PermissionError: {e}")
+            except Exception as e:
+                print(f"Error analyzing news with GPT-4: {e}")
+            return None
+
+    # Анализ сообщений пользователя
+    async def analyze_user_message(self, message, user_id=None):
+        result = classify_user_message(message)
+        if result is not None:
+            return result
+
+        try:
+            response = await self._chat_completion(self._user_message_request(message), user_id=user_id)
+            return response['choices'][0]['message']['content'].strip()
+        except ValueError:
+            return -4
+        except openai.error.PermissionError as e:
+            print(f"OpenAI PermissionError: {e}")
+
+    # Формирование окончательного сообщения
+    async def formation_final_message(self, days, crypto_id='bitcoin'):
+        # Одинаковые запросы в пределах временной корзины получают один и тот же отчёт
+        key = self.report_cache.key(crypto_id, days)
+        return await self.report_cache.get_or_create(key, lambda: self._build_final_message(days, crypto_id))
+
+    # Отчёт по частям: строка об изменении цены отправляется сразу, как
+    # только пришли цены, затем сообщение дополняется новостями по мере
+    # оценки чанков
+    async def stream_final_message(self, message, days, crypto_id='bitcoin'):
+        key = self.report_cache.key(crypto_id, days)
+        if self.report_cache.peek(key) is None and key not in self.report_cache.in_flight:
+            # Одновременные такие же запросы дождутся итогового текста этого отчёта
+            editors = []
+            await self.report_cache.get_or_create(key, lambda: self._stream_final_message(message, days, crypto_id, editors))
+            # Последняя правка ждёт паузу между правками уже после того, как
+            # отчёт попал в кэш, поэтому ожидающие его запросы её не ждут
+            if editors:
+                await editors[0].flush()
+            return
+        await message.answer(await self.formation_final_message(days, crypto_id))
+
+    # Общее вычисление отчёта: возвращает итоговый текст, а созданный
+    # редактор сообщения кладёт в editors для последней правки
+    async def _stream_final_message(self, message, days, crypto_id, editors):
+        news_task = asyncio.ensure_future(self.get_crypto_news(query=crypto_id, days=days))
+        try:
+            present_value, past_value = await self.get_crypto_prices(crypto_id=crypto_id, days=days)
+            text = f"{self._price_change_line(days, present_value, past_value, crypto_id)} \n\nAnalyzing the news over the given period..."
+            editor = ThrottledEditor(await message.answer(text), text)
+            editors.append(editor)
+
+            try:
+                news = await news_task
+                failed = 0
+                async for analyzed_news, failed in self.iter_news_sentiment(news):
+                    await editor.update(self._compose_final_message(days, analyzed_news, present_value, past_value, crypto_id))
+            except Exception as e:
+                # Заглушка "Analyzing the news..." заменяется строкой о цене с
+                # пометкой об ошибке; такой отчёт получают ожидающие, но не кэш
+                logging.error(f"Error analyzing news for the report: {e}")
+                text = f"{self._price_change_line(days, present_value, past_value, crypto_id)} \n\nCould not analyze the news right now, please try again later."
+                await editor.update(text)
+                return text, False
+            return editor.text, failed == 0
+        finally:
+            news_task.cancel()
+
+    async def _build_final_message(self, days, crypto_id):
+
+        # Новости и цены запрашиваются одновременно
+        news_task = asyncio.ensure_future(self.get_crypto_news(query=crypto_id, days=days))
+        prices_task = asyncio.ensure_future(self.get_crypto_prices(crypto_id=crypto_id, days=days))
+        try:
+            news = await news_task
+            analyzed_news, failed = await self._analyze_news(news)
+            present_value, past_value = await prices_task
+        finally:
+            prices_task.cancel()
+
+        return self._compose_final_message(days, analyzed_news, present_value, past_value, crypto_id), failed == 0
+
+# Общие хранилище цен и кэш сантиментов
+price_store = PriceStore()
+sentiment_cache = SentimentCache()
 
 # Создание экземпляра класса CryptoAnalyzer
-crypto_analyzer = CryptoAnalyzer(openai_key=openai.api_key, news_api_key=NEWS_API_KEY)
+crypto_analyzer = CryptoAnalyzer(openai_key=openai.api_key, news_api_key=NEWS_API_KEY, price_store=price_store, sentiment_cache=sentiment_cache)
+
+# Экземпляр, который использует бот
+async_crypto_analyzer = AsyncCryptoAnalyzer(openai_key=openai.api_key, news_api_key=NEWS_API_KEY, price_store=price_store, sentiment_cache=sentiment_cache)
 
 dp = Dispatcher()
 
@@ -197,7 +1209,7 @@ async def command_start_handler(message: Message) -> None:
 async def echo_handler(message: Message) -> None:
     last_user_message = message.text
     # Анализ сообщения пользователя
-    analysis_result = crypto_analyzer.analyze_user_message(last_user_message)
+    analysis_result = await async_crypto_analyzer.analyze_user_message(last_user_message, message.from_user.id)
     print(analysis_result)
     
     if analysis_result == '-1':
@@ -212,13 +1224,99 @@ async def echo_handler(message: Message) -> None:
             logging.error(f"Invalid value for days: {days}")
             await message.answer("Sorry, there was an error processing your request.")
             return
-        finally_message = crypto_analyzer.formation_final_message(days)
+        if STREAM_REPLIES:
+            await async_crypto_analyzer.stream_final_message(message, days)
+            return
+        finally_message = await async_crypto_analyzer.formation_final_message(days)
         await message.answer(finally_message)
 
+@dp.startup()
+async def on_startup() -> None:
+    await async_crypto_analyzer.start()
+
+@dp.shutdown()
+async def on_shutdown() -> None:
+    await async_crypto_analyzer.close()
+
+# Webhook: запрос Telegram подтверждается сразу, обновление уходит в
+# ограниченную очередь, которую разбирают WEBHOOK_WORKERS обработчиков.
+# При переполнении - 503 (Telegram повторит доставку), при остановке
+# принятые обновления дообрабатываются.
+async def run_webhook(bot):
+    queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+    stopped = asyncio.Event()
+    closing = False
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if closing:
+            return web.Response(status=503)
+        try:
+            queue.put_nowait(await request.json())
+        except ValueError:
+            return web.Response(status=400)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(request):
+        return web.Response(status=503 if closing else 200)
+
+    async def worker():
+        while True:
+            data = await queue.get()
+            try:
+                await dp.feed_update(bot, Update.model_validate(data, context={'bot': bot}))
+            except Exception as e:
+                logging.error(f"Ошибка при обработке обновления: {e}")
+            finally:
+                queue.task_done()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stopped.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/healthz', health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    workers = [asyncio.create_task(worker()) for _ in range(WEBHOOK_WORKERS)]
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        await stopped.wait()
+    finally:
+        closing = True
+        try:
+            await asyncio.wait_for(queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не обработано обновлений при остановке: {queue.qsize()}")
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
 async def main() -> None:
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     # Запуск бота
-    await dp.start_polling(bot)
+    if RUN_MODE == 'webhook':
+        await run_webhook(bot)
+    else:
+        # getUpdates не работает, пока у бота установлен webhook
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     # Настройка уровня логирования и запуск основного цикла событий
@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VOICE_BOT = os.path.join(ROOT, 'Voice_assistant_bot')
+
+# Модули голосового бота импортируются как "from config import set" и "from src.xxx import ..."
+for path in (ROOT, VOICE_BOT, os.path.join(VOICE_BOT, 'src')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Обязательные настройки голосового бота, чтобы config импортировался без .env
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:test')
+os.environ.setdefault('DATABASE_URL', 'sqlite+aiosqlite:///:memory:')
+os.environ.setdefault('AMPLITUDE_API_KEY', 'test')
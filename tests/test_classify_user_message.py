@@ -0,0 +1,43 @@
+from datetime import date
+
+import pytest
+
+from crypto_news_analyzer import classify_user_message
+
+TODAY = date(2026, 10, 18)
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("How much did the bitcoin price change in the last 7 days?", '7'),
+    ("Насколько изменилась цена биткоина за последние 3 дня?", '3'),
+    ("How much did the BTC rate change in the last two weeks?", '14'),
+    ("How much did the bitcoin price change since Oct 10?", '8'),
+    ("Как изменился курс биткоина с 1 октября?", '17'),
+    ("How much did bitcoin's price change since 11.10.2026?", '7'),
+    ("Did the bitcoin price go up 2.5% over the last 7 days?", '7'),
+    ("Did the price of bitcoin decrease 5% in the last 7 days?", '7'),
+    ("How much did the bitcoin price change in the last 2 weeks, maybe 3?", '14'),
+    ("Has bitcoin risen 3/4 of its value this year?", '365'),
+    ("What can you do?", '-1'),
+    ("help", '-1'),
+    ("Что ты умеешь?", '-1'),
+])
+def test_confident_answers(message, expected):
+    assert classify_user_message(message, TODAY) == expected
+
+
+@pytest.mark.parametrize('message', [
+    # Дробное число недель локально не считается
+    "How much did the bitcoin price change in the last 1.5 weeks?",
+    # Дата и период противоречат друг другу
+    "How much did the bitcoin price change since Oct 1 in the last 7 days?",
+    # Слово об изменении без упоминания цены
+    "I lost my bitcoin wallet 2 days ago, help",
+    "My bitcoin miner keeps dropping offline since last week",
+    "Will bitcoin price go up next week?",
+    "What do you think about the crypto market?",
+    "Can you help me with my homework?",
+    "what are you doing tonight",
+])
+def test_left_to_gpt(message):
+    assert classify_user_message(message, TODAY) is None
@@ -0,0 +1,135 @@
+import struct
+
+from src.ogg import (BEGIN_OF_STREAM, CONTINUED, END_OF_STREAM, PAGE_HEADER, OggPage,
+                     concat_opus, ogg_crc, read_pages, split_opus)
+
+PRE_SKIP = 312
+FRAME = 960  # 20 мс при 48 кГц
+TOC = 1 << 3  # SILK, 20 мс, один кадр в пакете
+
+
+def opus_head() -> bytes:
+    return b'OpusHead' + struct.pack('<BBHIhB', 1, 1, PRE_SKIP, 48000, 0, 0)
+
+
+def opus_tags() -> bytes:
+    vendor = b'test'
+    return b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+
+
+def lacing(packet: bytes) -> bytes:
+    return bytes([255] * (len(packet) // 255) + [len(packet) % 255])
+
+
+# Синтетический поток Ogg/Opus: заголовки на отдельных страницах, затем
+# страницы по packets_per_page пакетов; page_sizes задаёт размер пакетов каждой
+# страницы (у тишины пакеты маленькие)
+def make_stream(page_sizes: list[int], serial: int = 1, packets_per_page: int = 10) -> bytes:
+    output = bytearray()
+    output += OggPage(BEGIN_OF_STREAM, 0, serial, 0, lacing(opus_head()), opus_head()).to_bytes()
+    output += OggPage(0, 0, serial, 1, lacing(opus_tags()), opus_tags()).to_bytes()
+    granule = PRE_SKIP
+    for index, size in enumerate(page_sizes):
+        packets = [bytes([TOC]) + bytes([index % 256]) * (size - 1) for _ in range(packets_per_page)]
+        granule += FRAME * packets_per_page
+        header_type = END_OF_STREAM if index == len(page_sizes) - 1 else 0
+        segments = b''.join(lacing(packet) for packet in packets)
+        output += OggPage(header_type, granule, serial, index + 2, segments, b''.join(packets)).to_bytes()
+    return bytes(output)
+
+
+# Страницы потока в исходном виде с проверкой записанной CRC
+def checked_pages(data: bytes) -> list[OggPage]:
+    pages = read_pages(data)
+    offset = 0
+    for page in pages:
+        size = PAGE_HEADER.size + len(page.segments) + len(page.data)
+        raw = bytearray(data[offset:offset + size])
+        stored = struct.unpack_from('<I', raw, 22)[0]
+        struct.pack_into('<I', raw, 22, 0)
+        assert stored == ogg_crc(raw)
+        offset += size
+    assert offset == len(data)
+    return pages
+
+
+def packets(pages: list[OggPage]) -> list[bytes]:
+    result = []
+    packet = bytearray()
+    for page in pages:
+        offset = 0
+        for size in page.segments:
+            packet += page.data[offset:offset + size]
+            offset += size
+            if size < 255:
+                result.append(bytes(packet))
+                packet = bytearray()
+    return result
+
+
+# Поток, который декодер примет сам по себе: один заголовок OpusHead и один
+# OpusTags в начале, один серийный номер, страницы подряд, BOS только на
+# первой странице, EOS только на последней и неубывающие granule
+def assert_standalone(data: bytes) -> list[OggPage]:
+    pages = checked_pages(data)
+    all_packets = packets(pages)
+    assert all_packets[0].startswith(b'OpusHead')
+    assert all_packets[1].startswith(b'OpusTags')
+    assert sum(packet.startswith((b'OpusHead', b'OpusTags')) for packet in all_packets) == 2
+    assert len({page.serial for page in pages}) == 1
+    assert [page.sequence for page in pages] == list(range(len(pages)))
+    assert [bool(page.header_type & BEGIN_OF_STREAM) for page in pages] == [True] + [False] * (len(pages) - 1)
+    assert [bool(page.header_type & END_OF_STREAM) for page in pages] == [False] * (len(pages) - 1) + [True]
+    assert not pages[2].header_type & CONTINUED
+    granules = [page.granule for page in pages[2:]]
+    assert all(a < b for a, b in zip(granules, granules[1:]))
+    return pages
+
+
+def test_concat_two_streams():
+    first = make_stream([300] * 4, serial=1)
+    second = make_stream([40] * 3, serial=2)
+    output = concat_opus([first, second])
+
+    pages = assert_standalone(output)
+    assert len(pages) == 2 + 4 + 3
+    assert packets(pages)[2:] == packets(read_pages(first))[2:] + packets(read_pages(second))[2:]
+    # Длительность склейки равна сумме длительностей звука обоих потоков
+    assert pages[-1].granule == PRE_SKIP + (4 + 3) * 10 * FRAME
+
+
+def test_concat_single_stream_is_unchanged():
+    stream = make_stream([100] * 3)
+    assert concat_opus([stream]) == stream
+
+
+LOUD, QUIET = 200, 3
+
+
+def test_split_cuts_at_pauses():
+    # 30 страниц по 200 мс, паузы на страницах 11-12 и 23-24
+    sizes = [LOUD] * 30
+    for index in (11, 12, 23, 24):
+        sizes[index] = QUIET
+    stream = make_stream(sizes)
+
+    segments = split_opus(stream, segment_seconds=2, search_seconds=1)
+
+    assert len(segments) == 3
+    audio_pages = [len(read_pages(segment)) - 2 for segment in segments]
+    # Разрезы приходятся на середину пауз: после страниц 11 и 23
+    assert audio_pages == [12, 12, 6]
+    for segment, count in zip(segments, audio_pages):
+        pages = assert_standalone(segment)
+        assert packets(pages)[:2] == packets(read_pages(stream))[:2]
+        assert pages[-1].granule == PRE_SKIP + count * 10 * FRAME
+    # Части вместе содержат весь звук исходного потока
+    assert sum((packets(read_pages(segment))[2:] for segment in segments), []) == packets(read_pages(stream))[2:]
+
+
+def test_split_short_stream_is_single_segment():
+    stream = make_stream([LOUD] * 5)
+    segments = split_opus(stream, segment_seconds=2, search_seconds=1)
+    assert len(segments) == 1
+    assert_standalone(segments[0])
+    assert read_pages(segments[0]) == read_pages(stream)
@@ -0,0 +1,46 @@
+from crypto_news_analyzer import PriceStore
+
+HOUR = 3600
+DAY = 86400
+
+
+# Ответ market_chart/range с шагом точек, как у CoinGecko: дневные точки за
+# период больше 90 дней, почасовые за 1-90 дней, пятиминутные за меньший
+def market_chart_range(start, end):
+    period = end - start
+    step = DAY if period > 90 * DAY else HOUR if period >= DAY else 300
+    first = int(start // step + 1) * step
+    return [[t * 1000, float(t)] for t in range(first, int(end) + 1, step)]
+
+
+def fetch(store, crypto_id, start, end):
+    gaps = store.missing(crypto_id, start, end)
+    for gap_start, gap_end in gaps:
+        store.add(crypto_id, market_chart_range(gap_start, gap_end), gap_start, gap_end)
+    return gaps
+
+
+def test_long_fetch_keeps_hourly_points(tmp_path):
+    store = PriceStore(str(tmp_path))
+    now = 1_760_000_000
+    gaps = fetch(store, 'bitcoin', now - 365 * DAY, now)
+    assert all(gap_end - gap_start <= 90 * DAY for gap_start, gap_end in gaps)
+
+    timestamps, _ = store.load('bitcoin')
+    assert list(timestamps) == sorted(set(timestamps))
+    # Цена в точке равна её времени, поэтому видно, где начинается окно
+    for hours in (18, 24, 7 * 24):
+        start = now - hours * HOUR
+        _, past = store.window('bitcoin', start)
+        assert 0 <= past - start < HOUR
+
+
+def test_store_from_older_format_is_refetched(tmp_path):
+    store = PriceStore(str(tmp_path))
+    now = 1_760_000_000
+    fetch(store, 'bitcoin', now - 2 * DAY, now)
+    with open(tmp_path / 'bitcoin.json', 'w') as f:
+        f.write('{"from": %d}' % (now - 2 * DAY))
+
+    reloaded = PriceStore(str(tmp_path))
+    assert reloaded.missing('bitcoin', now - DAY, now) == [(now - DAY, now)]
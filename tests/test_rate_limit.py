@@ -0,0 +1,41 @@
+import pytest
+
+import crypto_news_analyzer
+from src import rate_limit
+
+MINUTE = 60
+
+
+# Серия запросов больше ёмкости ведра, каждый отправляется, как только ведро позволяет
+# Время отсчитывается от создания ведра
+def send_requests(bucket, amount, count):
+    start = now = bucket.updated
+    for _ in range(count):
+        now += bucket.wait_time(amount, now)
+        bucket.take(amount, now)
+    return now - start
+
+
+@pytest.mark.parametrize('bucket_class', [crypto_news_analyzer.TokenBucket, rate_limit.TokenBucket])
+def test_large_requests_are_paced_at_quota(bucket_class):
+    per_minute = 9000
+    bucket = bucket_class(per_minute, burst_seconds=5)
+    amount = 2000
+    assert amount > bucket.capacity
+
+    count = 50
+    elapsed = send_requests(bucket, amount, count)
+    # Всё, что списано до последнего запроса, укладывается в начальный запас и пополнение
+    assert amount * (count - 1) <= bucket.capacity + elapsed * per_minute / MINUTE + 1e-6
+    assert amount * count / (elapsed / MINUTE) == pytest.approx(per_minute, rel=0.05)
+
+
+@pytest.mark.parametrize('bucket_class', [crypto_news_analyzer.TokenBucket, rate_limit.TokenBucket])
+def test_small_requests_use_burst(bucket_class):
+    bucket = bucket_class(600, burst_seconds=5)
+    now = bucket.updated
+    assert bucket.wait_time(10, now) == 0
+    bucket.take(10, now)
+    assert bucket.wait_time(40, now) == 0
+    bucket.take(40, now)
+    assert bucket.wait_time(10, now) == pytest.approx(1.0)